@@ -1,15 +1,18 @@
 from flask import Flask, render_template, request, Response, jsonify
 import logging
 from logging.config import dictConfig
-from google import genai
-from google.genai import types
-import markdown
 import json
 import sys
 import os
 from flask_cors import CORS
-from chat_service import ChatService
+from werkzeug.http import generate_etag
+from runtime import runtime_role
 import whereami_payload
+import region_catalog
+import fast_json
+import backend_clients
+import asyncio
+import threading
 from concurrent import futures
 import multiprocessing
 import grpc
@@ -19,8 +22,11 @@ from grpc_health.v1 import health_pb2
 from grpc_health.v1 import health_pb2_grpc
 import whereami_pb2
 import whereami_pb2_grpc
+from google.protobuf import json_format
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
 from py_grpc_prometheus.prometheus_server_interceptor import PromServerInterceptor
+from grpc_aio_interceptor import AioPromServerInterceptor
 from prometheus_client import start_http_server
 
 os.environ["OTEL_PYTHON_FLASK_EXCLUDED_URLS"] = "healthz,metrics"
@@ -36,13 +42,19 @@ from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
 
 dictConfig({
     'version': 1,
+    'disable_existing_loggers': False,
     'formatters': {'default': {
         'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
     }},
+    'filters': {'rate_limit': {
+        '()': 'log_utils.RateLimitFilter'
+    }},
     'handlers': {'wsgi': {
-        'class': 'logging.StreamHandler',
+        # records are formatted and written on a background thread
+        'class': 'log_utils.QueueStreamHandler',
         'stream': 'ext://sys.stdout',
-        'formatter': 'default'
+        'formatter': 'default',
+        'filters': ['rate_limit']
     }},
     'root': {
         'level': 'INFO',
@@ -75,27 +87,170 @@ else:
 app = Flask(__name__)
 handler = logging.StreamHandler(sys.stdout)
 app.logger.addHandler(handler)
-app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
 FlaskInstrumentor().instrument_app(app)
 RequestsInstrumentor().instrument()
 app.config['JSON_AS_ASCII'] = False
 CORS(app)
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # running under gunicorn with several workers (see gunicorn.conf.py)
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 
-grpc_serving_port = int(os.environ.get('PORT', 9090))
+if os.getenv('SERVE_HTTP_AND_GRPC') == "True":
+    # PORT belongs to the HTTP listener
+    grpc_serving_port = int(os.environ.get('GRPC_PORT', 9090))
+else:
+    grpc_serving_port = int(os.environ.get('GRPC_PORT', os.environ.get('PORT', 9090)))
 grpc_metrics_port = 8000
+watch_min_interval = float(os.environ.get('WATCH_MIN_INTERVAL', 0.1))
+# each WatchPayload stream on the thread pool server holds a thread for as
+# long as it's open, so streams get threads of their own, up to this many
+grpc_max_watch_streams = int(os.environ.get('GRPC_MAX_WATCH_STREAMS', 16))
+# frontends ping their cached backend channels even while idle (see
+# BACKEND_GRPC_KEEPALIVE_TIME_MS); keep this below that interval
+grpc_min_ping_interval_ms = int(os.environ.get('GRPC_MIN_PING_INTERVAL_MS', 10000))
 
+role = runtime_role()
+logging.info("Runtime role: %s", role)
 whereami_payload = whereami_payload.WhereamiPayload()
+regions = region_catalog.RegionCatalog()
+
+def _reply_dict(payload):
+    """Reshape a payload dict, and every payload nested in it, to WhereamiReply's fields"""
+    payload = dict(payload)
+    backend = payload.pop('backend_result', None)
+    # several backends come back as a list, which maps to the repeated field;
+    # an HTTP backend may have fanned out itself, so this goes all the way down
+    if isinstance(backend, list):
+        payload['backend_results'] = [
+            dict(result, result=_reply_dict(result['result']))
+            if isinstance(result.get('result'), dict) else result
+            for result in backend]
+    elif isinstance(backend, dict):
+        payload['backend_result'] = _reply_dict(backend)
+    elif backend is not None:
+        payload['backend_result'] = backend
+    return payload
+
+def _to_reply(payload):
+    """Convert a payload dict into a WhereamiReply, dropping HTTP-only fields"""
+    return json_format.ParseDict(_reply_dict(payload), whereami_pb2.WhereamiReply(),
+                                 ignore_unknown_fields=True)
+
+def _mask_fields(mask):
+    """Payload keys needed to fill a FieldMask over WhereamiReply, or None for all of them"""
+    if not mask.paths:
+        return None
+    fields = set()
+    for path in mask.paths:
+        name = path.split('.')[0]
+        fields.add('backend_result' if name == 'backend_results' else name)
+    return fields
+
+def _invalid_mask(mask):
+    if not mask.paths:
+        return False
+    # protobuf can't apply sub-paths of a repeated field, so backend_results is all or nothing
+    return (not mask.IsValidForDescriptor(whereami_pb2.WhereamiReply.DESCRIPTOR)
+            or any(path.startswith('backend_results.') for path in mask.paths))
+
+def _masked_reply(payload, mask):
+    reply = _to_reply(payload)
+    if not mask.paths:
+        return reply
+    # trims nested paths such as backend_result.zone too
+    masked = whereami_pb2.WhereamiReply()
+    mask.MergeMessage(reply, masked)
+    return masked
+
+def _watch_interval(request):
+    return max(request.interval_seconds or 1.0, watch_min_interval)
+
+def _watch_key(reply):
+    """Serialize a reply without the fields that change on every tick"""
+    key = whereami_pb2.WhereamiReply()
+    key.CopyFrom(reply)
+    pending = [key]
+    while pending:
+        current = pending.pop()
+        current.ClearField('timestamp')
+        if current.HasField('backend_result'):
+            pending.append(current.backend_result)
+        for backend in current.backend_results:
+            backend.ClearField('latency_ms')
+            pending.append(backend.result)
+    return key.SerializeToString(deterministic=True)
 
 class WhereamigRPC(whereami_pb2_grpc.WhereamiServicer):
+    def __init__(self):
+        self._watch_slots = threading.BoundedSemaphore(grpc_max_watch_streams)
+
     def GetPayload(self, request, context):
-        payload = whereami_payload.build_payload(None)
-        return whereami_pb2.WhereamiReply(**payload)
+        if _invalid_mask(request.field_mask):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'invalid WhereamiReply field_mask')
+        payload = whereami_payload.build_payload(None, _mask_fields(request.field_mask))
+        return _masked_reply(payload, request.field_mask)
 
-def grpc_serve():
+    def WatchPayload(self, request, context):
+        if _invalid_mask(request.field_mask):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'invalid WhereamiReply field_mask')
+        # refuse rather than queue, so unary calls never wait behind streams
+        if not self._watch_slots.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                          'too many WatchPayload streams, try again later')
+        try:
+            interval = _watch_interval(request)
+            fields = _mask_fields(request.field_mask)
+            stopped = threading.Event()
+            context.add_callback(stopped.set)
+            last_key = None
+            while True:
+                reply = _masked_reply(whereami_payload.build_payload(None, fields), request.field_mask)
+                key = _watch_key(reply) if request.changes_only else None
+                if not request.changes_only or key != last_key:
+                    last_key = key
+                    yield reply
+                if stopped.wait(interval):
+                    return
+        finally:
+            self._watch_slots.release()
+
+class WhereamigRPCAsync(whereami_pb2_grpc.WhereamiServicer):
+    async def GetPayload(self, request, context):
+        if _invalid_mask(request.field_mask):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'invalid WhereamiReply field_mask')
+        payload = await whereami_payload.build_payload_async(None, _mask_fields(request.field_mask))
+        return _masked_reply(payload, request.field_mask)
+
+    async def WatchPayload(self, request, context):
+        if _invalid_mask(request.field_mask):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'invalid WhereamiReply field_mask')
+        interval = _watch_interval(request)
+        fields = _mask_fields(request.field_mask)
+        last_key = None
+        while True:
+            reply = _masked_reply(await whereami_payload.build_payload_async(None, fields), request.field_mask)
+            key = _watch_key(reply) if request.changes_only else None
+            if not request.changes_only or key != last_key:
+                last_key = key
+                yield reply
+            await asyncio.sleep(interval)
+
+def _grpc_server_options():
+    # by default a server only allows a ping every 5 minutes, and none between
+    # calls, answering anything more with GOAWAY too_many_pings
+    return [
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.min_ping_interval_without_data_ms', grpc_min_ping_interval_ms)
+    ]
+
+def grpc_server(start_metrics_server=True):
+    """Build and start the thread pool gRPC server"""
     server = grpc.server(
-        futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()+5),
-        interceptors=(PromServerInterceptor(),))
+        futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()+5+grpc_max_watch_streams),
+        interceptors=(PromServerInterceptor(),),
+        options=_grpc_server_options())
     whereami_pb2_grpc.add_WhereamiServicer_to_server(WhereamigRPC(), server)
     health_servicer = health.HealthServicer(
         experimental_non_blocking=True,
@@ -105,113 +260,261 @@ def grpc_serve():
         service.full_name
         for service in whereami_pb2.DESCRIPTOR.services_by_name.values()) + (
             reflection.SERVICE_NAME, health.SERVICE_NAME)
-    start_http_server(port=grpc_metrics_port)
+    if start_metrics_server:
+        start_http_server(port=grpc_metrics_port)
     reflection.enable_server_reflection(services, server)
     server.add_insecure_port(host_ip + ':' + str(grpc_serving_port))
     server.start()
     overall_server_health = ""
+    # report NOT_SERVING until the payload snapshot is ready
     for service in services + (overall_server_health,):
-        health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
-    server.wait_for_termination()
-
-client = genai.Client(
-    vertexai=True,
-    project=os.environ["PROJECT_ID"],
-    location="us-central1"
-)
-
-generate_content_config = types.GenerateContentConfig(
-    temperature=0.3,
-    top_p=0.6,
-    max_output_tokens=8192,
-    response_modalities=["TEXT"],
-    safety_settings=[
-        types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF")
-    ]
-)
+        health_servicer.set(service, health_pb2.HealthCheckResponse.NOT_SERVING)
+
+    def serve_when_ready():
+        whereami_payload.wait_ready()
+        for service in services + (overall_server_health,):
+            health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
+    threading.Thread(target=serve_when_ready, name='grpc-health', daemon=True).start()
+    return server
+
+def grpc_serve():
+    grpc_server().wait_for_termination()
+
+async def grpc_aio_serve(start_metrics_server=True):
+    # an in-flight RPC waiting on a backend costs a coroutine, not a thread
+    max_concurrent_rpcs = os.getenv('GRPC_MAX_CONCURRENT_RPCS')
+    server = grpc.aio.server(
+        interceptors=(AioPromServerInterceptor(),),
+        options=_grpc_server_options(),
+        maximum_concurrent_rpcs=int(max_concurrent_rpcs) if max_concurrent_rpcs else None)
+    whereami_pb2_grpc.add_WhereamiServicer_to_server(WhereamigRPCAsync(), server)
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    services = tuple(
+        service.full_name
+        for service in whereami_pb2.DESCRIPTOR.services_by_name.values()) + (
+            reflection.SERVICE_NAME, health.SERVICE_NAME)
+    if start_metrics_server:
+        start_http_server(port=grpc_metrics_port)
+    reflection.enable_server_reflection(services, server)
+    server.add_insecure_port(host_ip + ':' + str(grpc_serving_port))
+    await server.start()
+    overall_server_health = ""
+    # report NOT_SERVING until the payload snapshot is ready
+    for service in services + (overall_server_health,):
+        await health_servicer.set(service, health_pb2.HealthCheckResponse.NOT_SERVING)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, whereami_payload.wait_ready)
+        for service in services + (overall_server_health,):
+            await health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
+        await server.wait_for_termination()
+    finally:
+        await backend_clients.get_aio_grpc_channels().close()
+
+def start_grpc_alongside_http():
+    """
+    Start the gRPC server next to the HTTP server in this process.
+
+    Used when SERVE_HTTP_AND_GRPC=True: both listeners share the payload
+    snapshot and backend pools, and gRPC metrics are exported on
+    the HTTP server's /metrics rather than a separate port.
+
+    Returns:
+        A callable that stops the gRPC server
+    """
+    logging.info('gRPC server listening on port %s'%(grpc_serving_port))
+    if os.getenv('GRPC_ASYNC') == "True":
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(grpc_aio_serve(start_metrics_server=False))
+
+        def run():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass  # stopped by the returned callable
+
+        threading.Thread(target=run, name='grpc-aio', daemon=True).start()
+        return lambda: loop.call_soon_threadsafe(task.cancel)
+    server = grpc_server(start_metrics_server=False)
+    return lambda: server.stop(grace=5)
+
+# the LLM and GCP client libraries are only imported, and ChatService only
+# built, the first time a chat prompt arrives
+_chat_service = None
+_chat_service_lock = threading.Lock()
+
+def get_chat_service():
+    global _chat_service
+    if _chat_service is None:
+        with _chat_service_lock:
+            if _chat_service is None:
+                from chat_service import ChatService
+                _chat_service = ChatService()
+    return _chat_service
 
-# Initialize ChatService for LangChain/Gemini integration
-chat_service = ChatService()
+# keep proxies from buffering or caching the event stream
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# the payload differs from pod to pod, so only the client may cache it; by
+# default clients revalidate every time, which costs a 304 and no body
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', 0))
+CACHE_CONTROL = 'private, max-age=%d' % API_CACHE_MAX_AGE if API_CACHE_MAX_AGE > 0 else 'private, no-cache'
+
+# landing page ETags change when the template does, not just the region
+with open(os.path.join(app.root_path, 'templates', 'index.html'), 'rb') as f:
+    TEMPLATE_ETAG = generate_etag(f.read())
 
 def _get_region(zone: str) -> str:
     elements = zone.split('-')
     return '-'.join(elements[:2])
 
-def _get_location_from_json_list(file_path: str, region: str) -> str:
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-    for item in data['regions']:
-        if item.get('name') == region:
-            return item.get('location')
-    return None
+def _current_region():
+    # region and zone are static, so there's no need to build a payload (and call backends)
+    snapshot = whereami_payload.snapshot
+    if 'region' in snapshot:
+        return snapshot['region']
+    if 'zone' in snapshot:
+        return _get_region(snapshot['zone'])
+    logging.warning("Region cannot be located.")
+    return "unknown"
+
+def _conditional(etag, make_body):
+    """Answer 304 if the client already has etag, else build the response from make_body()"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = app.make_response(make_body())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
 
 
 @app.route('/healthz')
 @metrics.do_not_track()
 def i_am_healthy():
+    # not ready until GCE metadata has been fetched in the background
+    if not whereami_payload.is_ready():
+        return ('Not ready', 503)
     return ('OK')
 
+@app.route('/api/regions')
+def api_regions():
+    return jsonify({'regions': [dict(item) for item in regions.all()]})
+
+@app.route('/api/regions/<name>')
+def api_region(name):
+    region = regions.get(name)
+    if region is None:
+        return jsonify({'error': 'Unknown region: %s' % name}), 404
+    return jsonify(dict(region))
+
+def _wants_pretty():
+    pretty = request.args.get('pretty')
+    return pretty is not None and pretty.lower() not in ('0', 'false')
+
+def _json_response(body):
+    # full payloads carry a timestamp, so they're never worth caching
+    return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+def _requested_fields():
+    # ?fields=zone,pod_name limits the payload to those keys
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+    return tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+
 @app.route('/api/', defaults={'path': ''})
 @app.route('/api/<path:path>')
 def api(path):
-    payload = whereami_payload.build_payload(request.headers)
+    pretty = _wants_pretty()
     requested_value = path.split('/')[-1]
-    if requested_value in payload.keys():
-        return payload[requested_value]
-    return jsonify(payload)
+    if requested_value:
+        static = whereami_payload.static_fields((requested_value,))
+        if static is not None:
+            # static fields are answered from the snapshot and can be revalidated
+            values, etags = static
+            return _conditional(etags[0], lambda: values[requested_value])
+        # only compute the one field, so e.g. /api/timestamp doesn't call backends
+        payload = whereami_payload.build_payload(request.headers, fields=(requested_value,))
+        if requested_value in payload:
+            response = app.make_response(payload[requested_value])
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+
+    fields = _requested_fields()
+    if fields is not None:
+        static = whereami_payload.static_fields(fields) if fields else None
+        if static is not None:
+            # a projection of static fields is static too
+            values, etags = static
+            etag = generate_etag('\0'.join(fields + tuple(etags) + (str(pretty),)).encode('utf-8'))
+            return _conditional(etag, lambda: Response(fast_json.dumps(values, pretty=pretty),
+                                                       mimetype='application/json'))
+        response = Response(
+            fast_json.dumps(whereami_payload.build_payload(request.headers, fields), pretty=pretty),
+            mimetype='application/json')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    if not pretty:
+        # the common case: splice this request's fields onto the pre-encoded snapshot
+        return _json_response(whereami_payload.build_payload_json(request.headers))
+    payload = whereami_payload.build_payload(request.headers)
+    return _json_response(fast_json.dumps(payload, pretty=pretty))
 
 @app.route("/generate")
 def generate():
+    if role != 'chat':
+        return jsonify({'error': 'Chat is not enabled'}), 404
     prompt = request.args.get('prompt')
     if not prompt:
         return jsonify({'error': 'No prompt provided'}), 400
     
     # Get current deployment context
-    payload = whereami_payload.build_payload(request.headers)
-    if 'region' in payload:
-        region = payload['region']
-    elif 'zone' in payload:
-        region = _get_region(payload['zone'])
-    else:
-        region = "unknown"
-    
-    location = _get_location_from_json_list('/app/regions.json', region) or "unknown location"
+    region = _current_region()
+    location = regions.location(region) or "unknown location"
     
-    return Response(chat_service.stream_response(prompt, region, location), mimetype='text/event-stream')
+    return Response(get_chat_service().stream_response(prompt, region, location), mimetype='text/event-stream',
+                    headers=SSE_HEADERS)
 
 @app.route("/", methods=["GET"])
 def home():
+    if role != 'chat':
+        # payload-only pods answer / like /api
+        return _json_response(whereami_payload.build_payload_json(request.headers))
+
     prompt = request.args.get('prompt')
     
     # Get current deployment context
-    payload = whereami_payload.build_payload(request.headers)
-    if 'region' in payload:
-        region = payload['region']
-    elif 'zone' in payload:
-        region = _get_region(payload['zone'])
-    else:
-        logging.warning("Region cannot be located.")
-        region = "unknown"
-
-    location = _get_location_from_json_list('/app/regions.json', region) or "unknown location"
+    region = _current_region()
+    location = regions.location(region) or "unknown location"
     
     if prompt:
-        return Response(chat_service.stream_response(prompt, region, location), mimetype='text/event-stream')
+        return Response(get_chat_service().stream_response(prompt, region, location), mimetype='text/event-stream',
+                        headers=SSE_HEADERS)
     
     message = f"Hello from {region} in {location}!"
     default_prompt = f"What is an interesting fact about {location}?"
-    return render_template('index.html', message=message, default_prompt=default_prompt)
+    etag = generate_etag('\0'.join((TEMPLATE_ETAG, message, default_prompt)).encode('utf-8'))
+    return _conditional(etag, lambda: render_template('index.html', message=message,
+                                                      default_prompt=default_prompt))
 
-if __name__ == '__main__':
-    if os.getenv('GRPC_ENABLED') == "True":
+def main():
+    if role == 'grpc':
         logging.info('gRPC server listening on port %s'%(grpc_serving_port))
-        grpc_serve()
+        if os.getenv('GRPC_ASYNC') == "True":
+            asyncio.run(grpc_aio_serve())
+        else:
+            grpc_serve()
     else:
+        # development server; production HTTP is served by gunicorn (see server.py)
+        debug = os.getenv('FLASK_DEBUG') == "True"
         app.run(
             host=host_ip.strip('[]'),
             port=int(os.environ.get('PORT', 8080)),
-            debug=True,
+            debug=debug,
+            use_reloader=debug,
             threaded=True)
+
+if __name__ == '__main__':
+    main()
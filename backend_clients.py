@@ -0,0 +1,268 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from concurrent import futures
+import grpc
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from prometheus_client import Gauge
+import whereami_pb2
+import whereami_pb2_grpc
+
+# gauges are set explicitly rather than through set_function() so they're also
+# collected when gunicorn runs prometheus_client in multiprocess mode
+HTTP_POOL_GAUGES = {
+    'connections_opened': Gauge('whereami_backend_http_connections_opened',
+                                'Connections opened by the HTTP backend pool',
+                                multiprocess_mode='livesum'),
+    'connections_reused': Gauge('whereami_backend_http_connections_reused',
+                                'Backend requests served over an already open connection',
+                                multiprocess_mode='livesum'),
+    'requests': Gauge('whereami_backend_http_requests',
+                      'Requests sent by the HTTP backend pool',
+                      multiprocess_mode='livesum')
+}
+GRPC_CHANNELS_GAUGE = Gauge('whereami_backend_grpc_channels',
+                            'Open gRPC channels to backends',
+                            multiprocess_mode='livesum')
+
+class HttpBackendClient:
+    """Shared keep-alive connection pool for calls to HTTP backends"""
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None):
+        self.pool_size = pool_size or int(os.getenv('BACKEND_POOL_SIZE', 10))
+        self.timeout = (
+            connect_timeout or float(os.getenv('BACKEND_CONNECT_TIMEOUT', 1.0)),
+            read_timeout or float(os.getenv('BACKEND_READ_TIMEOUT', 5.0))
+        )
+        if max_retries is None:
+            max_retries = int(os.getenv('BACKEND_MAX_RETRIES', 2))
+
+        # only retry failures that happen before the backend saw the request, or
+        # that the backend explicitly marked as transient
+        retries = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=['GET'],
+            raise_on_status=False
+        )
+
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retries
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get_json(self, url, headers=None):
+        """
+        GET a backend and decode its JSON reply.
+
+        Args:
+            url (str): Backend URL, including the http:// or https:// scheme
+            headers (dict): Headers to propagate to the backend
+
+        Returns:
+            The decoded JSON body, or None if the backend returned an error status
+        """
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+        finally:
+            for name, value in self.pool_stats().items():
+                HTTP_POOL_GAUGES[name].set(value)
+        if r.ok:
+            return r.json()
+        return None
+
+    def pool_stats(self):
+        """
+        Summarize connection reuse across every host pool in the client.
+
+        Returns:
+            dict: Connections opened, requests sent and connections reused
+        """
+        pools = self.adapter.poolmanager.pools
+        opened = sent = 0
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                # pool was evicted between listing and lookup
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {
+            'connections_opened': opened,
+            'requests': sent,
+            'connections_reused': max(sent - opened, 0)
+        }
+
+    def close(self):
+        self.session.close()
+
+class GrpcChannelCache:
+    """Process-wide cache of gRPC channels to backends, keyed by target and credentials"""
+
+    def __init__(self, timeout=None, lb_policy=None):
+        self.timeout = timeout or float(os.getenv('BACKEND_GRPC_TIMEOUT', 5.0))
+        self.options = [
+            ('grpc.keepalive_time_ms', int(os.getenv('BACKEND_GRPC_KEEPALIVE_TIME_MS', 30000))),
+            ('grpc.keepalive_timeout_ms', int(os.getenv('BACKEND_GRPC_KEEPALIVE_TIMEOUT_MS', 10000))),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0)
+        ]
+        # BACKEND_GRPC_LB_POLICY is either a policy applied to every target
+        # (e.g. "round_robin") or a comma separated list of target=policy pairs
+        self.lb_policies = {}
+        for entry in (lb_policy or os.getenv('BACKEND_GRPC_LB_POLICY', '')).split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            target, _, policy = entry.rpartition('=')
+            self.lb_policies[target] = policy
+
+        self._stubs = {}
+        self._channels = []
+        self._lock = threading.Lock()
+
+    def _channel_options(self, target):
+        options = list(self.options)
+        policy = self.lb_policies.get(target, self.lb_policies.get(''))
+        if policy:
+            options.append(('grpc.service_config',
+                            json.dumps({'loadBalancingConfig': [{policy: {}}]})))
+        return options
+
+    def _open_channel(self, target, secure, options):
+        if secure:
+            logging.info("Opening gRPC secure channel to %s.", target)
+            return grpc.secure_channel(target, grpc.ssl_channel_credentials(), options=options)
+        logging.info("Opening gRPC insecure channel to %s.", target)
+        return grpc.insecure_channel(target, options=options)
+
+    def get_stub(self, target, secure=False):
+        """
+        Return a Whereami stub on a cached channel, opening the channel on first use.
+
+        Args:
+            target (str): Backend address as host:port
+            secure (bool): Use TLS channel credentials
+
+        Returns:
+            whereami_pb2_grpc.WhereamiStub
+        """
+        key = (target, secure)
+        stub = self._stubs.get(key)
+        if stub is None:
+            with self._lock:
+                stub = self._stubs.get(key)
+                if stub is None:
+                    channel = self._open_channel(target, secure, self._channel_options(target))
+                    stub = whereami_pb2_grpc.WhereamiStub(channel)
+                    self._channels.append(channel)
+                    GRPC_CHANNELS_GAUGE.inc()
+                    self._stubs[key] = stub
+        return stub
+
+    def get_payload(self, target, secure=False, metadata=None):
+        """Call GetPayload on a backend, bounded by the configured deadline"""
+        stub = self.get_stub(target, secure)
+        return stub.GetPayload(whereami_pb2.PayloadRequest(), timeout=self.timeout, metadata=metadata)
+
+    def channel_count(self):
+        return len(self._channels)
+
+    def close(self):
+        with self._lock:
+            for channel in self._channels:
+                channel.close()
+            GRPC_CHANNELS_GAUGE.dec(len(self._channels))
+            self._channels = []
+            self._stubs = {}
+
+class AioGrpcChannelCache(GrpcChannelCache):
+    """grpc.aio flavour of GrpcChannelCache, for backend calls made from the asyncio server"""
+
+    def _open_channel(self, target, secure, options):
+        if secure:
+            logging.info("Opening gRPC aio secure channel to %s.", target)
+            return grpc.aio.secure_channel(target, grpc.ssl_channel_credentials(), options=options)
+        logging.info("Opening gRPC aio insecure channel to %s.", target)
+        return grpc.aio.insecure_channel(target, options=options)
+
+    async def get_payload(self, target, secure=False, metadata=None):
+        """Call GetPayload on a backend, bounded by the configured deadline"""
+        stub = self.get_stub(target, secure)
+        return await stub.GetPayload(whereami_pb2.PayloadRequest(), timeout=self.timeout, metadata=metadata)
+
+    async def close(self):
+        with self._lock:
+            channels = self._channels
+            GRPC_CHANNELS_GAUGE.dec(len(channels))
+            self._channels = []
+            self._stubs = {}
+        for channel in channels:
+            await channel.close()
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    """Return the process-wide HTTP backend client, creating it on first use"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpBackendClient()
+                atexit.register(_http_client.close)
+                logging.info("HTTP backend pool created (size %s, timeouts %s).",
+                             _http_client.pool_size, _http_client.timeout)
+    return _http_client
+
+_grpc_channels = None
+_grpc_channels_lock = threading.Lock()
+
+def get_grpc_channels():
+    """Return the process-wide gRPC channel cache, creating it on first use"""
+    global _grpc_channels
+    if _grpc_channels is None:
+        with _grpc_channels_lock:
+            if _grpc_channels is None:
+                _grpc_channels = GrpcChannelCache()
+                atexit.register(_grpc_channels.close)
+    return _grpc_channels
+
+_aio_grpc_channels = None
+
+def get_aio_grpc_channels():
+    """
+    Return the gRPC aio channel cache. aio channels belong to the event loop
+    that created them, so this must only be called from the server's loop.
+    """
+    global _aio_grpc_channels
+    if _aio_grpc_channels is None:
+        _aio_grpc_channels = AioGrpcChannelCache()
+    return _aio_grpc_channels
+
+_fanout_executor = None
+_fanout_executor_lock = threading.Lock()
+
+def get_fanout_executor():
+    """Return the bounded thread pool used to call several backends at once"""
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _fanout_executor_lock:
+            if _fanout_executor is None:
+                _fanout_executor = futures.ThreadPoolExecutor(
+                    max_workers=int(os.getenv('BACKEND_FANOUT_WORKERS', 16)),
+                    thread_name_prefix='backend-fanout')
+    return _fanout_executor
@@ -0,0 +1,3 @@
+"""
+Hermetic load tests for whereami: run with `python -m benchmarks.run --help`
+"""
@@ -0,0 +1,120 @@
+"""
+Closed-loop load generator: each of `concurrency` threads sends a request,
+waits for the whole response, and sends the next one until time is up.
+"""
+
+import http.client
+import math
+import threading
+import time
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, or None when it's empty"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def summarize(scenario, concurrency, latencies, errors, elapsed):
+    """Reduce raw per-request latencies (seconds) to the result record for one run"""
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None
+        }
+    }
+
+def run_load(scenario, make_client, concurrency, duration, warmup=1.0):
+    """
+    Drive one scenario and summarize it.
+
+    Args:
+        scenario: Name recorded in the result
+        make_client: Called once per thread; returns a zero-argument callable
+            that makes one request and raises if it failed
+        concurrency: Number of threads with a request in flight
+        duration: Seconds to measure for, after warmup seconds unmeasured
+    """
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    start = threading.Barrier(concurrency + 1)
+    window = {}
+
+    def worker():
+        request = make_client()
+        local_latencies = []
+        local_errors = 0
+        start.wait()
+        while True:
+            started = time.perf_counter()
+            if started >= window['end']:
+                break
+            try:
+                request()
+            except Exception:
+                local_errors += started >= window['begin']
+                continue
+            if started >= window['begin']:
+                local_latencies.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    now = time.perf_counter()
+    window['begin'] = now + warmup
+    window['end'] = window['begin'] + duration
+    start.wait()
+    for t in threads:
+        t.join()
+    # requests still in flight at the deadline finish late; count the time they took
+    elapsed = max(time.perf_counter() - window['begin'], duration)
+    return summarize(scenario, concurrency, latencies, errors[0], elapsed)
+
+def http_client(host, port, path, timeout=60):
+    """Request factory for run_load(): GET path over one keep-alive connection per thread"""
+    def make_client():
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+        def request():
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            if response.status != 200:
+                raise RuntimeError('%s returned %d' % (path, response.status))
+        return request
+    return make_client
+
+def grpc_client(target, field_mask=None, timeout=60):
+    """Request factory for run_load(): GetPayload over a channel shared by all threads"""
+    import grpc
+    import whereami_pb2
+    import whereami_pb2_grpc
+
+    channel = grpc.insecure_channel(target)
+    stub = whereami_pb2_grpc.WhereamiStub(channel)
+    payload_request = whereami_pb2.PayloadRequest()
+    if field_mask:
+        payload_request.field_mask.paths.extend(field_mask)
+
+    def make_client():
+        return lambda: stub.GetPayload(payload_request, timeout=timeout)
+    return make_client
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Benchmark whereami end to end without network access.
+
+Starts the local stand-ins (GCE metadata server and an HTTP or gRPC backend)
+in a child process, serves the app with gunicorn.conf.py and
+SERVE_HTTP_AND_GRPC=True (with the stub chat model), then drives each scenario
+at each concurrency level and writes throughput and latency percentiles as JSON.
+
+    python -m benchmarks.run --scenarios api,api_field,grpc --concurrency 1,16 --duration 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Add parent directory to path to import app modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import loadgen, standins
+
+SCENARIOS = {
+    # name: (protocol, HTTP path or GetPayload field mask)
+    'api': ('http', '/api/'),
+    'api_field': ('http', '/api/zone'),
+    'generate': ('http', '/generate?prompt=What+is+an+interesting+fact+about+Iowa%3F'),
+    'grpc': ('grpc', None),
+    'grpc_field': ('grpc', ['zone'])
+}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios out of %s' % ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='comma-separated concurrency levels to run each scenario at')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each run')
+    parser.add_argument('--backend', choices=('none', 'http', 'grpc'), default='http',
+                        help='stub backend the app calls for full payloads')
+    parser.add_argument('--backend-latency', type=float, default=0.05,
+                        help='seconds the stub backend takes to answer')
+    parser.add_argument('--chat-tokens', type=int, default=50, help='chunks in each stub chat answer')
+    parser.add_argument('--chat-token-latency', type=float, default=0.01,
+                        help='seconds between stub chat chunks')
+    parser.add_argument('--chat-cache', action='store_true',
+                        help='leave the chat response cache on (by default every /generate reaches the model)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the app, e.g. --env GRPC_ASYNC=True')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(unknown))
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return args
+
+def app_env(args, ports):
+    env = dict(os.environ)
+    env.update({
+        'PROJECT_ID': 'bench-project',
+        'GCE_METADATA_HOST': '127.0.0.1:%d' % ports['metadata'],
+        'PORT': str(ports['http']),
+        'HOST': '127.0.0.1',
+        'GRPC_PORT': str(ports['grpc']),
+        'SERVE_HTTP_AND_GRPC': 'True',
+        'GUNICORN_WORKERS': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'BENCH_CHAT_TOKENS': str(args.chat_tokens),
+        'BENCH_CHAT_TOKEN_LATENCY': str(args.chat_token_latency),
+        'PYTHONPATH': ROOT
+    })
+    for name in ('WHEREAMI_ROLE', 'GRPC_ENABLED', 'PROMETHEUS_MULTIPROC_DIR'):
+        env.pop(name, None)
+    if not args.chat_cache:
+        env['CHAT_CACHE_TTL'] = '0'
+    if args.backend != 'none':
+        scheme = 'http://' if args.backend == 'http' else 'grpc://'
+        env['BACKEND_ENABLED'] = 'True'
+        env['BACKEND_SERVICE'] = '%s127.0.0.1:%d' % (scheme, ports['backend'])
+    for item in args.env:
+        name, _, value = item.partition('=')
+        env[name] = value
+    return env
+
+def wait_until_ready(ports, app, timeout=120):
+    import grpc
+    deadline = time.monotonic() + timeout
+    url = 'http://127.0.0.1:%d/healthz' % ports['http']
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError('app exited with status %d' % app.returncode)
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status == 200:
+                    break
+        except OSError:
+            pass
+        time.sleep(0.2)
+    else:
+        raise RuntimeError('app not ready after %ss' % timeout)
+    channel = grpc.insecure_channel('127.0.0.1:%d' % ports['grpc'])
+    grpc.channel_ready_future(channel).result(timeout=max(deadline - time.monotonic(), 1))
+    channel.close()
+
+def client_for(scenario, ports):
+    protocol, target = SCENARIOS[scenario]
+    if protocol == 'http':
+        return loadgen.http_client('127.0.0.1', ports['http'], target)
+    return loadgen.grpc_client('127.0.0.1:%d' % ports['grpc'], field_mask=target)
+
+def main(argv=None):
+    args = parse_args(argv)
+    ports = {name: free_port() for name in ('metadata', 'backend', 'http', 'grpc')}
+
+    ready = multiprocessing.Event()
+    stand_ins = multiprocessing.Process(
+        target=standins.serve, daemon=True,
+        args=(ports['metadata'], args.backend, ports['backend'], args.backend_latency, ready))
+    stand_ins.start()
+    ready.wait(30)
+
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         'benchmarks.stub_app:app'],
+        cwd=ROOT, env=app_env(args, ports),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_until_ready(ports, app)
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                result = loadgen.run_load(scenario, client_for(scenario, ports), concurrency,
+                                          args.duration, args.warmup)
+                results.append(result)
+                latency = result['latency_ms']
+                print('%-10s c=%-4d %9.1f rps  p50 %8s ms  p95 %8s ms  p99 %8s ms  errors %d' % (
+                    scenario, concurrency, result['throughput_rps'], latency['p50'],
+                    latency['p95'], latency['p99'], result['errors']), file=sys.stderr)
+    finally:
+        app.terminate()
+        try:
+            app.wait(30)
+        except subprocess.TimeoutExpired:
+            app.kill()
+        stand_ins.terminate()
+
+    document = json.dumps({
+        'config': {
+            'backend': args.backend,
+            'backend_latency_s': args.backend_latency,
+            'chat_tokens': args.chat_tokens,
+            'chat_token_latency_s': args.chat_token_latency,
+            'chat_cache': args.chat_cache,
+            'workers': args.workers,
+            'threads': args.threads,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'env': args.env,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+if __name__ == '__main__':
+    main()
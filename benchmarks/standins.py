@@ -0,0 +1,145 @@
+"""
+Local stand-ins for everything whereami talks to, so benchmarks need no network
+access: a GCE metadata server, whereami-shaped HTTP and gRPC backends with a
+configurable latency, and a chat model that streams a canned answer.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FAKE_METADATA = {
+    'project': {'projectId': 'bench-project'},
+    'instance': {
+        'zone': 'projects/123/zones/us-central1-a',
+        'id': 1234567890,
+        'attributes': {'cluster-name': 'bench-cluster'},
+        'serviceAccounts': {'default': {'email': 'bench@bench-project.iam.gserviceaccount.com'}}
+    }
+}
+
+BACKEND_PAYLOAD = {
+    'cluster_name': 'bench-backend-cluster',
+    'pod_name': 'bench-backend',
+    'project_id': 'bench-project',
+    'zone': 'us-east1-b'
+}
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real servers
+    # headers and body go out in separate writes; without this, Nagle's
+    # algorithm and delayed ACKs add ~40ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class MetadataHandler(_QuietHandler):
+    """Answers recursive metadata GETs, holding wait_for_change polls until they time out"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.startswith('/computeMetadata/v1/') or self.headers.get('Metadata-Flavor') != 'Google':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        if query.get('wait_for_change') == ['true']:
+            # metadata never changes here, so a watch just waits out its timeout
+            self.server.stopping.wait(float(query.get('timeout_sec', ['300'])[0]))
+        self.send_json(FAKE_METADATA, {'ETag': 'bench-etag', 'Metadata-Flavor': 'Google'})
+
+class BackendHandler(_QuietHandler):
+    """A whereami backend that answers every GET after server.latency seconds"""
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_json(BACKEND_PAYLOAD)
+
+def _http_server(handler, port, **attrs):
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.stopping = threading.Event()
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_metadata_server(port=0):
+    """Start the metadata stand-in; point GCE_METADATA_HOST at 127.0.0.1:<server_port>"""
+    return _http_server(MetadataHandler, port)
+
+def start_http_backend(port=0, latency=0.0):
+    return _http_server(BackendHandler, port, latency=latency)
+
+def start_grpc_backend(port=0, latency=0.0):
+    """Start a Whereami gRPC backend; returns (server, bound port)"""
+    import grpc
+    import whereami_pb2
+    import whereami_pb2_grpc
+
+    class StubWhereami(whereami_pb2_grpc.WhereamiServicer):
+        def GetPayload(self, request, context):
+            time.sleep(latency)
+            return whereami_pb2.WhereamiReply(**BACKEND_PAYLOAD)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=64))
+    whereami_pb2_grpc.add_WhereamiServicer_to_server(StubWhereami(), server)
+    port = server.add_insecure_port('127.0.0.1:%d' % port)
+    server.start()
+    return server, port
+
+def serve(metadata_port, backend_protocol, backend_port, backend_latency, ready=None):
+    """
+    Run the metadata server and, optionally, a backend until the process is
+    killed. Benchmarks run this in a child process so the stand-ins don't
+    compete with the load generator for the GIL.
+    """
+    # hold on to the servers: a gRPC server stops when it's garbage collected
+    servers = [start_metadata_server(metadata_port)]
+    if backend_protocol == 'http':
+        servers.append(start_http_backend(backend_port, backend_latency))
+    elif backend_protocol == 'grpc':
+        servers.append(start_grpc_backend(backend_port, backend_latency))
+    if ready is not None:
+        ready.set()
+    threading.Event().wait()
+
+class StubChatModel:
+    """
+    Drop-in for ChatVertexAI that streams a canned answer of BENCH_CHAT_TOKENS
+    chunks, BENCH_CHAT_TOKEN_LATENCY seconds apart, and never calls tools.
+    """
+
+    def __init__(self, **kwargs):
+        self.tokens = int(os.getenv('BENCH_CHAT_TOKENS', 50))
+        self.token_latency = float(os.getenv('BENCH_CHAT_TOKEN_LATENCY', 0.01))
+
+    def bind_tools(self, tools):
+        return self
+
+    def _answer(self):
+        # a few paragraphs' worth, so the markdown splitting is exercised too
+        words = ['word%d%s' % (i, '.\n\n' if i % 20 == 19 else ' ') for i in range(self.tokens)]
+        # and the structured fields ChatService asks for at the end
+        words.append('\n\n<!--whereami {"is_technical": false, "location_mentioned": null, "sections": null} -->')
+        return words
+
+    def stream(self, messages):
+        from langchain_core.messages import AIMessageChunk
+        for word in self._answer():
+            time.sleep(self.token_latency)
+            yield AIMessageChunk(content=word)
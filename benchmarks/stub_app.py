@@ -0,0 +1,11 @@
+"""
+WSGI entrypoint for benchmarks: the real app, with the stub chat model in place
+of Vertex AI. Serve it with gunicorn.conf.py like the container does.
+"""
+
+import chat_service
+from benchmarks.standins import StubChatModel
+
+chat_service.ChatVertexAI = StubChatModel
+
+from app import app
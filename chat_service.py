@@ -1,13 +1,41 @@
 import logging
 import os
 import json
+import time
+from concurrent import futures
 import markdown
+from prometheus_client import Counter, Histogram
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain_google_vertexai import ChatVertexAI
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.messages import ToolMessage
+from langchain_core.pydantic_v1 import BaseModel, Field, ValidationError
 from typing import Optional, List
-from gcp_tools import get_gcp_region_info, list_gcp_regions, get_gcp_services_in_region
+from gcp_tools import get_gcp_region_info, get_gcp_regions_info, list_gcp_regions, get_gcp_services_in_region
 from weather_tools import get_current_weather, get_weather_forecast
+from response_cache import ResponseCache, normalize_prompt
+
+CHAT_GENERATIONS = Counter('whereami_chat_generations',
+                           'Chat responses generated, by how the answer was obtained',
+                           ['path'])
+CHAT_GENERATION_SECONDS = Histogram('whereami_chat_generation_seconds',
+                                    'Time spent generating a chat response',
+                                    ['path'],
+                                    buckets=(0.5, 1, 2, 4, 8, 16, 32, 64))
+
+CHAT_TOOL_CALLS = Counter('whereami_chat_tool_calls',
+                          'Tool calls made while answering chat prompts',
+                          ['tool', 'result'])
+CHAT_TOOL_SECONDS = Histogram('whereami_chat_tool_seconds',
+                              'Time spent running a chat tool',
+                              ['tool'],
+                              buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+# how many times the model may go back to tools before it has to answer
+MAX_TOOL_ROUNDS = 3
+
+# the model ends its answer with its structured fields in an HTML comment that
+# starts with this, so they arrive in the same streamed message as the content
+FIELDS_MARKER = '<!--whereami'
 
 class ChatResponse(BaseModel):
     """Structured response model for chat responses"""
@@ -22,6 +50,7 @@ class ChatService:
         self.tools = [
             {"google_search": {}},
             get_gcp_region_info,
+            get_gcp_regions_info,
             list_gcp_regions,
             get_gcp_services_in_region,
             get_current_weather,
@@ -29,17 +58,15 @@ class ChatService:
         ]
         
         # Initialize LangChain ChatVertexAI model with all tools
-        self.langchain_llm = ChatVertexAI(
+        self.llm = ChatVertexAI(
             model="gemini-2.5-flash",
             project=os.environ["PROJECT_ID"],
             location="us-central1",
             temperature=0.3,
             top_p=0.6,
             max_output_tokens=8192
-        ).bind_tools(self.tools)
-        
-        # Create structured output version for consistent formatting
-        self.structured_llm = self.langchain_llm.with_structured_output(ChatResponse)
+        )
+        self.langchain_llm = self.llm.bind_tools(self.tools)
         
         # Define system message template for GCP/cloud regions focus
         system_template = """You are a helpful AI assistant specialized in Google Cloud Platform (GCP) and cloud computing topics, with a particular focus on cloud regions, zones, and geographic distribution of cloud services.
@@ -58,6 +85,7 @@ AVAILABLE TOOLS:
 You have access to the following specialized tools that you should use when appropriate:
 - google_search: For general web searches and current information
 - get_gcp_region_info: Get detailed information about a specific GCP region including zones and quotas
+- get_gcp_regions_info: Get the same details for several regions in one call, e.g. when comparing regions
 - list_gcp_regions: List all available GCP regions with basic information  
 - get_gcp_services_in_region: Get information about GCP services available in a specific region
 - get_current_weather: Get current weather information for any location
@@ -103,11 +131,11 @@ Response approach:
 
 IMPORTANT: Only include weather information when users are asking about cities/locations from a geographical or cultural perspective, not when asking technical questions about GCP regions.
 
-RESPONSE FORMAT: You must respond with structured content that includes:
-- content: The main response text with proper markdown formatting
-- sections: List any major sections if your response has multiple parts
-- is_technical: Set to true for GCP/cloud technical questions, false for geographical/cultural questions
-- location_mentioned: The city/location name if the user is asking about a specific place
+RESPONSE FORMAT: Write your answer with markdown formatting. Then end it with one last line that holds these fields as JSON inside an HTML comment, exactly like this:
+<!--whereami {{"is_technical": false, "location_mentioned": "Paris", "sections": ["Culture", "Weather", "Cloud regions"]}} -->
+- is_technical: true for GCP/cloud technical questions, false for geographical/cultural questions
+- location_mentioned: The city/location name if the user is asking about a specific place, otherwise null
+- sections: The major sections if your response has multiple parts, otherwise null
 """
 
         # Create the prompt template
@@ -116,84 +144,143 @@ RESPONSE FORMAT: You must respond with structured content that includes:
             HumanMessagePromptTemplate.from_template("{user_message}")
         ])
 
-    def generate_response(self, prompt, region=None, location=None):
-        """
-        Generate a response using LangChain with Google Search grounding.
+        # identical prompts from the same region (e.g. the landing page's default
+        # prompt) are answered from cache instead of calling the model again
+        self.response_cache = ResponseCache()
+
+        # tools the model can call that run here rather than on Google's side
+        self.tools_by_name = {t.name: t for t in self.tools if hasattr(t, 'invoke')}
+        self.tool_timeout = float(os.getenv('CHAT_TOOL_TIMEOUT', 15))
+        self.tool_executor = futures.ThreadPoolExecutor(
+            max_workers=int(os.getenv('CHAT_TOOL_WORKERS', 8)),
+            thread_name_prefix='chat-tool')
+
+    def _format_markdown(self, full_response):
+        """Tidy up model output (citations, bullet styles) before it's rendered as markdown"""
+        # Ensure full_response is a string (handle case where it might be a list)
+        if isinstance(full_response, list):
+            full_response = ' '.join(str(item) for item in full_response)
+        elif not isinstance(full_response, str):
+            full_response = str(full_response)
         
-        Args:
-            prompt (str): User's input message
-            region (str): GCP region where app is deployed
-            location (str): Geographic location of deployment
-            
-        Returns:
-            str: Formatted HTML response
-        """
-        logging.info(f"ChatService generating response for prompt: {prompt}")
+        # Clean up citations and improve formatting
+        full_response = full_response.replace("[my knowledge]", "")
+        
+        # Improve list formatting
+        # Convert "* " at start of lines to proper markdown
+        lines = full_response.split('\n')
+        formatted_lines = []
+        for line in lines:
+            # Handle bullet points that start with "* "
+            if line.strip().startswith('* '):
+                formatted_lines.append(line)
+            # Handle bullet points that start with "•"
+            elif line.strip().startswith('•'):
+                formatted_lines.append(line.replace('•', '*'))
+            # Add proper spacing for list items if they don't have it
+            elif line.strip() and not line.startswith(' ') and any(prev_line.strip().startswith(('*', '-')) for prev_line in formatted_lines[-1:] if prev_line.strip()):
+                formatted_lines.append(f"* {line.strip()}")
+            else:
+                formatted_lines.append(line)
         
+        full_response = '\n'.join(formatted_lines)
+        
+        return full_response
+
+    def _run_tool(self, tool_call):
+        name = tool_call['name']
+        tool = self.tools_by_name.get(name)
+        if tool is None:
+            return f"Unknown tool: {name}"
+        started = time.monotonic()
+        result = 'ok'
         try:
-            # Format the prompt using LangChain template
-            formatted_prompt = self.chat_prompt.format_messages(
-                region=region or "unknown",
-                location=location or "unknown location",
-                user_message=prompt
-            )
-            
-            # Use structured LangChain output for consistent formatting
-            try:
-                structured_response = self.structured_llm.invoke(formatted_prompt)
-                # Extract just the content field from the structured response
-                if hasattr(structured_response, 'content') and structured_response.content:
-                    full_response = structured_response.content
-                    logging.info(f"Structured response - Technical: {structured_response.is_technical}, Location: {structured_response.location_mentioned}")
-                else:
-                    # Handle case where structured response doesn't have expected content
-                    full_response = str(structured_response)
-                    logging.warning(f"Structured response missing content field: {structured_response}")
-            except Exception as struct_error:
-                logging.warning(f"Structured output failed, falling back to regular response: {struct_error}")
-                # Fallback to regular response
-                response = self.langchain_llm.invoke(formatted_prompt)
-                if hasattr(response, 'content'):
-                    full_response = response.content
-                else:
-                    full_response = str(response)
-            
-            # Ensure full_response is a string (handle case where it might be a list)
-            if isinstance(full_response, list):
-                full_response = ' '.join(str(item) for item in full_response)
-            elif not isinstance(full_response, str):
-                full_response = str(full_response)
-            
-            # Clean up citations and improve formatting
-            full_response = full_response.replace("[my knowledge]", "")
-            
-            # Improve list formatting
-            # Convert "* " at start of lines to proper markdown
-            lines = full_response.split('\n')
-            formatted_lines = []
-            for line in lines:
-                # Handle bullet points that start with "* "
-                if line.strip().startswith('* '):
-                    formatted_lines.append(line)
-                # Handle bullet points that start with "•"
-                elif line.strip().startswith('•'):
-                    formatted_lines.append(line.replace('•', '*'))
-                # Add proper spacing for list items if they don't have it
-                elif line.strip() and not line.startswith(' ') and any(prev_line.strip().startswith(('*', '-')) for prev_line in formatted_lines[-1:] if prev_line.strip()):
-                    formatted_lines.append(f"* {line.strip()}")
-                else:
-                    formatted_lines.append(line)
-            
-            full_response = '\n'.join(formatted_lines)
-            
-            # Format the response with markdown
-            formatted_text = markdown.markdown(full_response)
-            return formatted_text
-            
+            return str(tool.invoke(tool_call['args']))
         except Exception as e:
-            logging.error(f"Error in ChatService.generate_response: {str(e)}", exc_info=True)
-            error_response = f'Error: {str(e)}'
-            return markdown.markdown(error_response)
+            result = 'error'
+            logging.warning(f"Tool {name} failed: {str(e)}")
+            return json.dumps({"error": f"Tool {name} failed: {str(e)}"})
+        finally:
+            CHAT_TOOL_SECONDS.labels(tool=name).observe(time.monotonic() - started)
+            CHAT_TOOL_CALLS.labels(tool=name, result=result).inc()
+
+    def _run_tools(self, tool_calls):
+        """
+        Run the tool calls from one model turn concurrently.
+
+        Every call gets the same tool_timeout, so a turn takes as long as its
+        slowest tool rather than the sum of them. A call that times out is
+        answered with an error and left to finish in the background.
+
+        Returns:
+            list: ToolMessages in the order of tool_calls
+        """
+        pending = [self.tool_executor.submit(self._run_tool, tool_call) for tool_call in tool_calls]
+        futures.wait(pending, timeout=self.tool_timeout)
+
+        messages = []
+        for tool_call, future in zip(tool_calls, pending):
+            if future.done():
+                content = future.result()
+            else:
+                logging.warning(f"Tool {tool_call['name']} timed out after {self.tool_timeout}s")
+                CHAT_TOOL_CALLS.labels(tool=tool_call['name'], result='timeout').inc()
+                content = json.dumps({"error": f"Tool {tool_call['name']} timed out"})
+            messages.append(ToolMessage(content=content, tool_call_id=tool_call['id']))
+        return messages
+
+    def _stream_events(self, prompt, region=None, location=None):
+        """
+        Stream the model's answer, running any tools it asks for between rounds.
+
+        Yields:
+            dict: {'tool': name} when a tool is called, then {'chunk': html, 'tail': html}
+                  as text arrives; 'chunk' is HTML for finished markdown blocks and
+                  is only ever appended to, 'tail' is the block still being written.
+                  Last comes {'fields': {...}} with the answer's structured fields,
+                  or {'fields': None} when the model didn't send them
+        """
+        messages = self.chat_prompt.format_messages(
+            region=region or "unknown",
+            location=location or "unknown location",
+            user_message=prompt
+        )
+
+        text = ''
+        answered = False
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            # out of tool rounds: the last call gets no tools, so it has to answer
+            llm = self.langchain_llm if tool_round < MAX_TOOL_ROUNDS else self.llm
+            message = None
+            for chunk in llm.stream(messages):
+                message = chunk if message is None else message + chunk
+                delta = _chunk_text(chunk.content)
+                if not delta:
+                    continue
+                # the fields comment is held back rather than rendered
+                text, trailer = _split_fields(text + delta)
+                done, text = _split_markdown(text)
+                answered = answered or bool(done.strip())
+                yield {
+                    'chunk': markdown.markdown(self._format_markdown(done)) if done else '',
+                    'tail': markdown.markdown(self._format_markdown(text))
+                }
+                text += trailer
+
+            if message is None or not message.tool_calls:
+                break
+            messages.append(message)
+            for tool_call in message.tool_calls:
+                yield {'tool': tool_call['name']}
+            messages.extend(self._run_tools(message.tool_calls))
+
+        text, trailer = _split_fields(text)
+        if text.strip():
+            yield {'chunk': markdown.markdown(self._format_markdown(text)), 'tail': ''}
+        elif not answered:
+            # raised rather than returned, so an empty answer isn't cached
+            raise RuntimeError('The model finished without an answer, try again')
+        yield {'fields': _parse_fields(trailer)}
 
     def stream_response(self, prompt, region=None, location=None):
         """
@@ -207,9 +294,119 @@ RESPONSE FORMAT: You must respond with structured content that includes:
         Yields:
             str: Server-sent event formatted response chunks
         """
+        key = (normalize_prompt(prompt), region, location)
+        state, value = self.response_cache.claim(key)
+        if state == 'hit':
+            yield from _cached_events(value)
+            return
+
         try:
-            formatted_text = self.generate_response(prompt, region, location)
-            yield f"data: {json.dumps({'chunk': formatted_text})}\n\n"
+            if state == 'wait':
+                # the same prompt is already being answered; reuse its result
+                yield from _cached_events(self.response_cache.wait(value))
+                return
+
+            html = []
+            fields = None
+            started = time.monotonic()
+            try:
+                for event in self._stream_events(prompt, region, location):
+                    if event.get('chunk'):
+                        html.append(event['chunk'])
+                    if 'fields' in event:
+                        fields = event['fields']
+                        if fields is None:
+                            continue
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                CHAT_GENERATIONS.labels(path='error').inc()
+                CHAT_GENERATION_SECONDS.labels(path='error').observe(time.monotonic() - started)
+                self.response_cache.fail(key, value, e)
+                raise
+            except BaseException as e:
+                # GeneratorExit when the client goes away mid-stream; anyone
+                # waiting on this answer gets a RuntimeError instead
+                self.response_cache.fail(key, value, e)
+                raise
+            # same call either way; 'fallback' answers just came without fields
+            path = 'structured' if fields is not None else 'fallback'
+            CHAT_GENERATIONS.labels(path=path).inc()
+            CHAT_GENERATION_SECONDS.labels(path=path).observe(time.monotonic() - started)
+            if fields is not None:
+                logging.info(f"Structured response - Technical: {fields['is_technical']}, Location: {fields['location_mentioned']}")
+            self.response_cache.fill(key, value, {'html': ''.join(html), 'fields': fields})
         except Exception as e:
             logging.error(f"Error in ChatService.stream_response: {str(e)}", exc_info=True)
-            yield f"data: {json.dumps({'chunk': f'Error: {str(e)}'})}\n\n"
\ No newline at end of file
+            yield f"data: {json.dumps({'chunk': f'Error: {str(e)}'})}\n\n"
+
+def _cached_events(answer):
+    """SSE events replaying a cached answer: its HTML in one chunk, then its fields if it had any"""
+    yield f"data: {json.dumps({'chunk': answer['html']})}\n\n"
+    if answer['fields'] is not None:
+        yield f"data: {json.dumps({'fields': answer['fields']})}\n\n"
+
+def _split_fields(text):
+    """
+    Split streamed text into the answer and the fields comment at its end.
+
+    A partial marker at the very end is held back too, since it may turn out
+    to be the start of the comment once more text arrives.
+
+    Returns:
+        tuple: (answer text, fields comment or '')
+    """
+    start = text.find(FIELDS_MARKER)
+    if start != -1:
+        return text[:start], text[start:]
+    for size in range(min(len(FIELDS_MARKER) - 1, len(text)), 0, -1):
+        if FIELDS_MARKER.startswith(text[-size:]):
+            return text[:-size], text[-size:]
+    return text, ''
+
+def _parse_fields(trailer):
+    """The structured fields in a fields comment as a dict, or None when it's missing or malformed"""
+    if not trailer.startswith(FIELDS_MARKER):
+        return None
+    body = trailer[len(FIELDS_MARKER):]
+    end = body.find('-->')
+    if end != -1:
+        body = body[:end]
+    try:
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            return None
+        response = ChatResponse(content='', **data)
+    except (ValueError, TypeError, ValidationError) as e:
+        logging.warning(f"Structured fields could not be parsed, answering without them: {str(e)}")
+        return None
+    fields = response.dict()
+    del fields['content']
+    return fields
+
+def _chunk_text(content):
+    """Pull the text out of a message chunk's content, which may be a list of parts"""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content or []:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and part.get('type', 'text') == 'text':
+            parts.append(part.get('text', ''))
+    return ''.join(parts)
+
+def _split_markdown(text):
+    """
+    Split streamed markdown into finished blocks and the block still being written.
+
+    Blocks end at a blank line, unless that blank line is inside a code fence.
+
+    Returns:
+        tuple: (finished markdown, remaining markdown)
+    """
+    cut = text.rfind('\n\n')
+    while cut != -1 and text.count('```', 0, cut) % 2:
+        cut = text.rfind('\n\n', 0, cut)
+    if cut == -1:
+        return '', text
+    return text[:cut], text[cut + 2:]
@@ -0,0 +1,38 @@
+import json
+
+# orjson is optional: it's several times faster than the standard library
+# encoder, but everything works without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj, pretty=False):
+    """
+    Encode obj as UTF-8 JSON bytes.
+
+    Output is compact by default; pretty output is indented with sorted keys,
+    matching what jsonify produced in debug mode.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if pretty else 0
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def encode_prefix(mapping):
+    """Encode a mapping as a JSON object with the closing brace left off, for splice()"""
+    return dumps(dict(mapping))[:-1]
+
+def splice(prefix, fields):
+    """
+    Close an object started by encode_prefix(), appending the fields in dict
+    fields. Only fields is encoded; the keys must not already be in the prefix.
+    """
+    if not fields:
+        return prefix + b'}'
+    encoded = dumps(fields)
+    if prefix == b'{':
+        return encoded
+    return prefix + b',' + encoded[1:]
@@ -1,12 +1,126 @@
 import logging
 import os
 import json
+import threading
+import time
 from typing import Dict, List, Optional
 from langchain_core.tools import tool
 from google.cloud import compute_v1
 from google.cloud import resourcemanager_v3
 import requests
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(client_class):
+    """
+    Return a shared instance of a Cloud client class, creating it on first use.
+
+    Clients hold their own connection and credentials, so building one per tool
+    call means a new connection and token exchange each time.
+    """
+    client = _clients.get(client_class)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(client_class)
+            if client is None:
+                client = _clients[client_class] = client_class()
+    return client
+
+class RefreshingCache:
+    """
+    TTL cache for slow-changing API data.
+
+    Expired entries keep being served while a background thread refreshes them
+    (stale-while-revalidate), and are kept if the refresh fails, so callers only
+    wait on the API the first time a key is loaded.
+    """
+
+    def __init__(self, ttl=None, retry_after=60):
+        self.ttl = ttl if ttl is not None else float(os.getenv('GCP_CACHE_TTL', 86400))
+        self.retry_after = retry_after
+        self._entries = {}  # key -> (loaded_at, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Return the value for key, calling loader() to load it the first time.
+
+        Args:
+            key: Hashable cache key
+            loader: Zero-argument callable fetching the value; raises on failure
+
+        Returns:
+            The cached value, which may be stale while a refresh is in flight
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            value = loader()
+            self._entries[key] = (time.monotonic(), value)
+            return value
+        if time.monotonic() - entry[0] >= self.ttl:
+            self._refresh(key, loader)
+        return entry[1]
+
+    def _refresh(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._entries[key] = (time.monotonic(), loader())
+            except Exception as e:
+                logging.warning(f"Refreshing {key} failed, serving stale data: {str(e)}")
+                # try again after retry_after rather than on every call
+                loaded_at, value = self._entries[key]
+                self._entries[key] = (time.monotonic() - self.ttl + self.retry_after, value)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='gcp-cache-refresh', daemon=True).start()
+
+    def clear(self):
+        self._entries = {}
+
+# region and zone data rarely changes, so tool calls share one cache
+gcp_cache = RefreshingCache()
+
+def _load_region(project_id, region):
+    region_info = get_client(compute_v1.RegionsClient).get(project=project_id, region=region)
+    return {
+        "region": region_info.name,
+        "description": region_info.description,
+        "status": region_info.status,
+        "quotas": [{"metric": quota.metric, "limit": quota.limit} for quota in region_info.quotas][:5],  # Limit to first 5
+        "deprecated": getattr(region_info, 'deprecated', None) is not None
+    }
+
+def _load_regions(project_id):
+    return [{
+        "name": region.name,
+        "description": region.description,
+        "status": region.status,
+        "zone_count": len([zone for zone in region.zones])
+    } for region in get_client(compute_v1.RegionsClient).list(project=project_id)]
+
+def _load_zone_index(project_id):
+    """List every zone once and group them by region"""
+    index = {}
+    for zone in get_client(compute_v1.ZonesClient).list(project=project_id):
+        index.setdefault(zone.region.split('/')[-1], []).append(zone.name)
+    return {region: sorted(zones) for region, zones in index.items()}
+
+def _region_info(project_id, region):
+    result = dict(gcp_cache.get(('region', project_id, region),
+                                lambda: _load_region(project_id, region)))
+    zone_index = gcp_cache.get(('zones', project_id), lambda: _load_zone_index(project_id))
+    result["zones"] = zone_index.get(region, [])
+    return result
+
 class GCPTools:
     """Tools for interacting with GCP APIs to get region and service information"""
     
@@ -32,31 +146,39 @@ class GCPTools:
             if not project_id:
                 return json.dumps({"error": "PROJECT_ID not configured"})
             
-            client = compute_v1.RegionsClient()
-            
-            # Get region details
-            region_info = client.get(project=project_id, region=region)
-            
-            # Get zones in this region
-            zones_client = compute_v1.ZonesClient()
-            zones = zones_client.list(project=project_id)
-            region_zones = [zone.name for zone in zones if zone.region.endswith(f"/{region}")]
-            
-            result = {
-                "region": region_info.name,
-                "description": region_info.description,
-                "status": region_info.status,
-                "zones": region_zones,
-                "quotas": [{"metric": quota.metric, "limit": quota.limit} for quota in region_info.quotas][:5],  # Limit to first 5
-                "deprecated": getattr(region_info, 'deprecated', None) is not None
-            }
-            
-            return json.dumps(result, indent=2)
+            return json.dumps(_region_info(project_id, region), indent=2)
             
         except Exception as e:
             logging.error(f"Error getting GCP region info for {region}: {str(e)}")
             return json.dumps({"error": f"Failed to get region info: {str(e)}"})
     
+    @tool
+    def get_gcp_regions_info(regions: List[str]) -> str:
+        """
+        Get detailed information about several GCP regions at once, including their zones.
+        Use this instead of calling get_gcp_region_info repeatedly when comparing regions.
+        
+        Args:
+            regions: GCP region names (e.g., ['us-central1', 'europe-west1'])
+            
+        Returns:
+            JSON string with a list of region details; regions that can't be looked up carry an error
+        """
+        project_id = os.environ.get("PROJECT_ID")
+        
+        if not project_id:
+            return json.dumps({"error": "PROJECT_ID not configured"})
+        
+        result = []
+        for region in regions:
+            try:
+                result.append(_region_info(project_id, region))
+            except Exception as e:
+                logging.error(f"Error getting GCP region info for {region}: {str(e)}")
+                result.append({"region": region, "error": f"Failed to get region info: {str(e)}"})
+        
+        return json.dumps({"regions": result}, indent=2)
+    
     @tool
     def list_gcp_regions() -> str:
         """
@@ -71,18 +193,7 @@ class GCPTools:
             if not project_id:
                 return json.dumps({"error": "PROJECT_ID not configured"})
             
-            client = compute_v1.RegionsClient()
-            
-            regions = client.list(project=project_id)
-            
-            result = []
-            for region in regions:
-                result.append({
-                    "name": region.name,
-                    "description": region.description,
-                    "status": region.status,
-                    "zone_count": len([zone for zone in region.zones])
-                })
+            result = gcp_cache.get(('regions', project_id), lambda: _load_regions(project_id))
             
             return json.dumps({"regions": result}, indent=2)
             
@@ -146,5 +257,6 @@ class GCPTools:
 # Create instances of the tools for easy import
 gcp_tools = GCPTools()
 get_gcp_region_info = gcp_tools.get_gcp_region_info
+get_gcp_regions_info = gcp_tools.get_gcp_regions_info
 list_gcp_regions = gcp_tools.list_gcp_regions  
 get_gcp_services_in_region = gcp_tools.get_gcp_services_in_region
\ No newline at end of file
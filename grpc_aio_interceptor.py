@@ -0,0 +1,91 @@
+import inspect
+from timeit import default_timer
+import grpc
+from prometheus_client.registry import REGISTRY
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus import server_metrics
+
+class AioPromServerInterceptor(grpc.aio.ServerInterceptor):
+    """
+    grpc.aio counterpart of py_grpc_prometheus' PromServerInterceptor.
+
+    PromServerInterceptor only works with the sync server, so this records the
+    same metrics (grpc_server_started_total, grpc_server_handled_total, ...)
+    for coroutine handlers, keeping dashboards working in either server mode.
+    """
+
+    def __init__(self, enable_handling_time_histogram=False, registry=REGISTRY):
+        self._enable_handling_time_histogram = enable_handling_time_histogram
+        self._grpc_server_handled_total_counter = server_metrics.get_grpc_server_handled_counter(
+            False, registry)
+        self._metrics = server_metrics.init_metrics(registry)
+
+    def _labels(self, metric, grpc_type, service, method):
+        return self._metrics[metric].labels(
+            grpc_type=grpc_type, grpc_service=service, grpc_method=method)
+
+    def _handled(self, grpc_type, service, method, code, start):
+        self._grpc_server_handled_total_counter.labels(
+            grpc_type=grpc_type, grpc_service=service, grpc_method=method,
+            grpc_code=code.name).inc()
+        if self._enable_handling_time_histogram:
+            self._labels("grpc_server_handled_histogram", grpc_type, service, method).observe(
+                max(default_timer() - start, 0))
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        service, method, _ = grpc_utils.split_method_call(handler_call_details)
+        grpc_type = grpc_utils.get_method_type(handler.request_streaming, handler.response_streaming)
+
+        if handler.unary_unary and inspect.iscoroutinefunction(handler.unary_unary):
+            behavior = handler.unary_unary
+
+            async def unary_unary(request, context):
+                start = default_timer()
+                self._labels("grpc_server_started_counter", grpc_type, service, method).inc()
+                code = grpc.StatusCode.UNKNOWN
+                try:
+                    response = await behavior(request, context)
+                    code = context.code() or grpc.StatusCode.OK
+                    return response
+                except BaseException:
+                    code = context.code() or grpc.StatusCode.UNKNOWN
+                    raise
+                finally:
+                    self._handled(grpc_type, service, method, code, start)
+
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary,
+                request_deserializer=handler.request_deserializer,
+                response_serializer=handler.response_serializer)
+
+        if handler.unary_stream and inspect.isasyncgenfunction(handler.unary_stream):
+            behavior = handler.unary_stream
+
+            async def unary_stream(request, context):
+                start = default_timer()
+                self._labels("grpc_server_started_counter", grpc_type, service, method).inc()
+                sent = self._labels("grpc_server_stream_msg_sent", grpc_type, service, method)
+                code = grpc.StatusCode.UNKNOWN
+                try:
+                    async for response in behavior(request, context):
+                        sent.inc()
+                        yield response
+                    code = context.code() or grpc.StatusCode.OK
+                except BaseException:
+                    # a cancelled stream surfaces here as CancelledError
+                    code = context.code() or grpc.StatusCode.CANCELLED
+                    raise
+                finally:
+                    self._handled(grpc_type, service, method, code, start)
+
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream,
+                request_deserializer=handler.request_deserializer,
+                response_serializer=handler.response_serializer)
+
+        # other handler shapes (e.g. reflection's bidi stream) pass through untouched
+        return handler
@@ -0,0 +1,80 @@
+# gunicorn settings for serving the Flask app in production (see server.py)
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+_host = os.getenv('HOST', '0.0.0.0')
+bind = _host + ':' + os.getenv('PORT', '8080')
+
+def _cpu_quota():
+    """CPUs the container's cgroup may use, rounded up, or None when it isn't limited"""
+    try:
+        # cgroup v2
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ('max', '-1'):
+        return None
+    try:
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+# a worker that has loaded the chat stack takes a few hundred MB, so size the
+# pool by the pod's CPU limit rather than the node's CPU count
+workers = int(os.getenv('GUNICORN_WORKERS') or
+              min(_cpu_quota() or 2, multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+# chat responses are streamed over SSE and can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+
+# import app.py (GCE metadata, region data) once in the master and share it
+# with every worker instead of rebuilding it per worker; the chat stack isn't
+# part of that, each worker loads it when its first prompt arrives
+preload_app = True
+
+# the container runs with a read-only root filesystem, so keep worker
+# heartbeat files and metrics in memory
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# prometheus_flask_exporter needs prometheus_client's multiprocess mode to
+# aggregate metrics across workers; the directory has to be set before
+# prometheus_client is imported, which preload_app does after this file loads
+_metrics_dir = None
+if workers > 1 and not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    _metrics_dir = tempfile.mkdtemp(prefix='whereami-metrics-', dir=globals().get('worker_tmp_dir'))
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = _metrics_dir
+
+def post_worker_init(worker):
+    # SERVE_HTTP_AND_GRPC=True runs the gRPC server inside each worker, next to
+    # the WSGI app; workers share the gRPC port through SO_REUSEPORT
+    if os.getenv('SERVE_HTTP_AND_GRPC') == "True":
+        import app
+        worker.stop_grpc = app.start_grpc_alongside_http()
+
+def worker_exit(server, worker):
+    stop_grpc = getattr(worker, 'stop_grpc', None)
+    if stop_grpc:
+        stop_grpc()
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
+
+def on_exit(server):
+    if _metrics_dir:
+        shutil.rmtree(_metrics_dir, ignore_errors=True)
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+_logged_once = set()
+_logged_once_lock = threading.Lock()
+
+def log_once(level, msg, *args):
+    """
+    Log a message the first time it's seen in this process and drop repeats.
+
+    For capability warnings (e.g. "Unable to capture node name") that describe
+    the environment rather than a request, so they'd say the same thing every time.
+    """
+    key = (level, msg)
+    if key in _logged_once:
+        return
+    with _logged_once_lock:
+        if key in _logged_once:
+            return
+        _logged_once.add(key)
+    logging.log(level, msg, *args, stacklevel=2)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `limit` records per message per `interval` seconds.
+
+    Records are grouped by logger, level and unformatted message, so a backend
+    failing on every request logs a handful of lines a minute rather than one
+    per request. The first record after a quiet spell notes how many were dropped.
+    Only WARNING and above are limited.
+    """
+
+    def __init__(self, limit=None, interval=None, level=logging.WARNING):
+        super().__init__()
+        self.limit = limit if limit is not None else int(os.getenv('LOG_RATE_LIMIT', 10))
+        self.interval = interval if interval is not None else float(os.getenv('LOG_RATE_LIMIT_INTERVAL', 60))
+        self.level = level
+        self._windows = {}  # key -> [window start, records let through, records dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level or self.limit <= 0:
+            return True
+        # msg can be any object (logging.warning({...}) is allowed), and unhashable ones mustn't raise
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if dropped:
+                    record.msg = "%s (%d similar messages suppressed)" % (record.msg, dropped)
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Stream handler that formats and writes records on a background thread.
+
+    Logging calls only enqueue the record; a QueueListener does the formatting
+    and the write to the stream. The listener is restarted after a fork, so
+    each gunicorn worker drains its own queue.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # formatting happens on the listener thread; records never leave the process
+        return record
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._listener is not None and self._pid is not None:
+                # inherited from the parent process, whose listener thread didn't survive the fork
+                self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._pid = os.getpid()
+            # stopping the listener drains anything still queued
+            atexit.register(self._stop_listener, self._listener)
+
+    def _stop_listener(self, listener):
+        if listener._thread is not None and self._pid == os.getpid():
+            listener.stop()
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def close(self):
+        if self._listener is not None:
+            self._stop_listener(self._listener)
+        super().close()
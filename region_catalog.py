@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+from types import MappingProxyType
+
+DEFAULT_REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regions.json')
+
+class RegionCatalog:
+    """
+    Indexed, read-only view of regions.json.
+
+    The file is parsed once and kept as a dict keyed by region name; it's only
+    re-read when its mtime changes, so lookups on the request path cost a stat()
+    and a dict lookup rather than an open() and a json.load().
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('REGIONS_FILE', DEFAULT_REGIONS_FILE)
+        # (mtime, regions by name, ordered list of regions), swapped as one tuple
+        # so readers never see a half-built index
+        self._index = (None, MappingProxyType({}), ())
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            if self._index[0] is not None:
+                logging.warning("Region catalog %s is gone, keeping the last loaded copy.", self.path)
+            return self._index
+        if mtime == self._index[0]:
+            return self._index
+
+        with self._lock:
+            if mtime == self._index[0]:
+                return self._index
+            try:
+                with open(self.path, 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                logging.warning("Unable to load region catalog %s.", self.path)
+                return self._index
+            regions = tuple(MappingProxyType(dict(item)) for item in data.get('regions', [])
+                            if item.get('name'))
+            self._index = (mtime, MappingProxyType({item['name']: item for item in regions}), regions)
+            logging.info("Loaded %s regions from %s.", len(regions), self.path)
+        return self._index
+
+    def all(self):
+        """Return every region, in file order"""
+        return self._load()[2]
+
+    def get(self, name):
+        """
+        Look up a region by region name or by one of its zones.
+
+        Args:
+            name (str): Region (e.g. us-central1) or zone (e.g. us-central1-a)
+
+        Returns:
+            The region entry, or None if it isn't in the catalog
+        """
+        by_name = self._load()[1]
+        region = by_name.get(name)
+        if region is None and name.count('-') > 1:
+            # zones are the region name plus a -<letter> suffix
+            region = by_name.get(name.rsplit('-', 1)[0])
+        return region
+
+    def location(self, name):
+        """Return the location of a region or zone, or None if it's unknown"""
+        region = self.get(name)
+        if region is None:
+            return None
+        return region.get('location')
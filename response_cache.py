@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+from prometheus_client import Counter, Gauge
+
+CACHE_REQUESTS = Counter('whereami_response_cache_requests',
+                         'Lookups in a response cache',
+                         ['cache', 'result'])
+CACHE_ENTRIES = Gauge('whereami_response_cache_entries',
+                      'Entries held in a response cache',
+                      ['cache'],
+                      multiprocess_mode='livesum')
+
+def normalize_prompt(prompt):
+    """Collapse whitespace and case so trivially different prompts share a cache entry"""
+    return ' '.join((prompt or '').split()).lower()
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache with a TTL, for expensive calls such as LLM or
+    weather API responses.
+
+    Concurrent lookups of a missing key are coalesced: the first caller computes
+    the value and the rest wait for its result, so only one call per key is in
+    flight. Failures are handed to every waiting caller but never cached; if
+    the computing caller is abandoned, the waiters get a RuntimeError, and if
+    it takes longer than wait_timeout, a TimeoutError.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, name='chat', wait_timeout=None):
+        self.name = name
+        self.ttl = ttl if ttl is not None else float(os.getenv('CHAT_CACHE_TTL', 3600))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 256))
+        # a waiter is only as quick as the caller it waits on, whose pace may be
+        # set by a slow client; don't let that hold the waiter's thread forever
+        self.wait_timeout = wait_timeout if wait_timeout is not None else float(
+            os.getenv('CHAT_CACHE_WAIT_TIMEOUT', os.getenv('GUNICORN_TIMEOUT', 120)))
+        self._requests = {result: CACHE_REQUESTS.labels(cache=name, result=result)
+                          for result in ('hit', 'miss', 'coalesced')}
+        self._size = CACHE_ENTRIES.labels(cache=name)
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}           # key -> Future of the call computing it
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def claim(self, key):
+        """
+        Look up key, registering the caller as the one to compute it on a miss.
+
+        Args:
+            key: Hashable cache key
+
+        Returns:
+            ('hit', value) when the key is cached, ('wait', future) when another
+            caller is already computing it (pass it to wait()), or ('lead', future)
+            when the caller must compute it and then call fill() or fail() with the future
+        """
+        if not self.enabled:
+            return 'lead', None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._requests['hit'].inc()
+                    return 'hit', entry[1]
+                del self._entries[key]
+                self._size.dec()
+
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self._requests['coalesced'].inc()
+                return 'wait', pending
+            pending = self._in_flight[key] = futures.Future()
+            self._requests['miss'].inc()
+            return 'lead', pending
+
+    def fill(self, key, pending, value):
+        """Cache the value computed for a claimed key and hand it to waiting callers"""
+        if pending is None:
+            return
+        with self._lock:
+            del self._in_flight[key]
+            if key not in self._entries:
+                self._size.inc()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._size.dec()
+        pending.set_result(value)
+
+    def fail(self, key, pending, exc):
+        """Release a claimed key without caching anything, passing exc to waiting callers"""
+        if pending is None:
+            return
+        with self._lock:
+            del self._in_flight[key]
+        if not isinstance(exc, Exception):
+            # GeneratorExit or KeyboardInterrupt stop the caller that claimed the
+            # key; waiting callers should see an ordinary error they can report
+            exc = RuntimeError('the request computing this response was abandoned, try again')
+        pending.set_exception(exc)
+
+    def wait(self, pending):
+        """
+        Wait for the value another caller is computing.
+
+        Raises:
+            TimeoutError: when it isn't ready within wait_timeout seconds
+            Exception: whatever the computing caller failed with
+        """
+        try:
+            return pending.result(timeout=self.wait_timeout)
+        except futures.TimeoutError:
+            raise TimeoutError(f"Gave up after {self.wait_timeout:g}s waiting for an identical "
+                               f"request already in progress, try again") from None
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, calling compute() to fill it on a miss.
+
+        Args:
+            key: Hashable cache key
+            compute: Zero-argument callable producing the value
+
+        Returns:
+            The cached or freshly computed value
+        """
+        state, value = self.claim(key)
+        if state == 'hit':
+            return value
+        if state == 'wait':
+            return self.wait(value)
+
+        try:
+            result = compute()
+        except BaseException as e:
+            self.fail(key, value, e)
+            raise
+        self.fill(key, value, result)
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._size.dec(len(self._entries))
+            self._entries.clear()
+        logging.info("Response cache cleared.")
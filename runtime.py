@@ -0,0 +1,21 @@
+import os
+
+# chat: HTTP payload API plus the chat UI and /generate
+# http: HTTP payload API only
+# grpc: gRPC payload service only
+ROLES = ('chat', 'http', 'grpc')
+
+def runtime_role():
+    """
+    Return what this process serves, from WHEREAMI_ROLE.
+
+    Without WHEREAMI_ROLE, GRPC_ENABLED=True selects the gRPC role as it always
+    has, and anything else serves HTTP with chat. Only the chat role loads the
+    LLM and GCP client libraries, and only on first use.
+    """
+    role = os.getenv('WHEREAMI_ROLE')
+    if not role:
+        return 'grpc' if os.getenv('GRPC_ENABLED') == "True" else 'chat'
+    if role not in ROLES:
+        raise ValueError("WHEREAMI_ROLE must be one of %s, not %r" % (', '.join(ROLES), role))
+    return role
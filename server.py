@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Container entrypoint for whereami.
+
+HTTP is served by gunicorn using gunicorn.conf.py, which also starts the
+gRPC server in the same process when SERVE_HTTP_AND_GRPC=True. The gRPC-only
+role (WHEREAMI_ROLE=grpc, or GRPC_ENABLED=True) and the Flask development
+server (FLASK_DEBUG=True) are started through app.main().
+"""
+
+import os
+import sys
+from runtime import runtime_role
+
+def main():
+    dual = os.getenv('SERVE_HTTP_AND_GRPC') == "True"
+    if not dual and (runtime_role() == 'grpc' or os.getenv('FLASK_DEBUG') == "True"):
+        import app
+        app.main()
+        return
+
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    sys.argv = ['gunicorn', '--config', config, 'app:app']
+    from gunicorn.app.wsgiapp import run
+    run()
+
+if __name__ == '__main__':
+    main()
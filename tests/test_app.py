@@ -7,11 +7,32 @@ import unittest
 import json
 import os
 import sys
+import threading
 from unittest.mock import patch, MagicMock
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+class _PassThroughInterceptor:
+    """Stands in for PromServerInterceptor, whose metrics can only be registered once per process"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        return continuation(handler_call_details)
+
+def static_fields(values, etags):
+    """Stand-in for WhereamiPayload.static_fields over a fixed snapshot"""
+    def lookup(names):
+        if not all(name in etags for name in names):
+            return None
+        return {name: values[name] for name in names}, [etags[name] for name in names]
+    return lookup
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
 class TestApp(unittest.TestCase):
     
     def setUp(self):
@@ -20,9 +41,7 @@ class TestApp(unittest.TestCase):
         os.environ['PROJECT_ID'] = 'test-project'
         
         # Mock the app import to avoid issues with missing dependencies
-        with patch('app.ChatService'), \
-             patch('app.genai'), \
-             patch('app.whereami_payload'):
+        with patch('app.whereami_payload'):
             from app import app
             self.app = app
             self.client = app.test_client()
@@ -30,53 +49,130 @@ class TestApp(unittest.TestCase):
 
     def test_health_endpoint(self):
         """Test the health check endpoint"""
-        response = self.client.get('/healthz')
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.is_ready.return_value = True
+            response = self.client.get('/healthz')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data.decode(), 'OK')
 
+    def test_health_endpoint_before_metadata(self):
+        """Test the health check reports not ready until the payload snapshot is built"""
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.is_ready.return_value = False
+            response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 503)
+
     def test_api_endpoint_without_path(self):
         """Test the API endpoint without specific path"""
         with patch('app.whereami_payload') as mock_payload:
-            mock_payload.build_payload.return_value = {
-                'zone': 'us-central1-a',
-                'region': 'us-central1',
-                'cluster_name': 'test-cluster'
-            }
+            mock_payload.build_payload_json.return_value = \
+                b'{"zone":"us-central1-a","region":"us-central1","cluster_name":"test-cluster"}'
             
             response = self.client.get('/api/')
             self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.headers['Cache-Control'], 'no-store')
             
             # Should return JSON
             data = json.loads(response.data)
             self.assertIn('zone', data)
             self.assertIn('region', data)
 
+    def test_api_endpoint_pretty(self):
+        """Test ?pretty returns indented JSON with sorted keys"""
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.build_payload.return_value = {'zone': 'us-central1-a', 'region': 'us-central1'}
+            response = self.client.get('/api/?pretty')
+        self.assertEqual(response.data.decode(),
+                         '{\n  "region": "us-central1",\n  "zone": "us-central1-a"\n}')
+        mock_payload.build_payload_json.assert_not_called()
+
     def test_api_endpoint_with_specific_value(self):
         """Test the API endpoint requesting a specific value"""
         with patch('app.whereami_payload') as mock_payload:
-            mock_payload.build_payload.return_value = {
-                'zone': 'us-central1-a',
-                'region': 'us-central1'
-            }
+            mock_payload.static_fields.side_effect = static_fields(
+                {'zone': 'us-central1-a', 'region': 'us-central1'},
+                {'zone': 'zone-etag', 'region': 'region-etag'})
+            # the body comes from the same snapshot read as the ETag, not a later one
+            mock_payload.snapshot = {}
             
             response = self.client.get('/api/zone')
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.data.decode(), 'us-central1-a')
+            self.assertEqual(response.headers['ETag'], '"zone-etag"')
+            mock_payload.build_payload.assert_not_called()
+
+    def test_api_field_conditional_get(self):
+        """Test static fields carry an ETag and a matching If-None-Match gets a 304"""
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.static_fields.side_effect = static_fields(
+                {'zone': 'us-central1-a'}, {'zone': 'zone-etag'})
+            response = self.client.get('/api/zone')
+            self.assertEqual(response.headers['ETag'], '"zone-etag"')
+            self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+
+            response = self.client.get('/api/zone', headers={'If-None-Match': '"zone-etag"'})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            response = self.client.get('/api/zone', headers={'If-None-Match': '"stale"'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_api_volatile_field_is_not_cached(self):
+        """Test per-request fields are built fresh and marked no-store"""
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.static_fields.return_value = None
+            mock_payload.build_payload.return_value = {'timestamp': '2024-01-01T00:00:00'}
+            response = self.client.get('/api/timestamp')
+        self.assertEqual(response.data.decode(), '2024-01-01T00:00:00')
+        self.assertNotIn('ETag', response.headers)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        # only the requested field is built
+        self.assertEqual(mock_payload.build_payload.call_args.kwargs['fields'], ('timestamp',))
+
+    def test_api_fields_projection(self):
+        """Test ?fields= limits the payload, and static projections can be revalidated"""
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.static_fields.side_effect = static_fields(
+                {'zone': 'value-zone', 'pod_name': 'value-pod_name'}, {'zone': 'z', 'pod_name': 'p'})
+            mock_payload.build_payload.side_effect = lambda headers, fields: \
+                {name: 'value-' + name for name in fields}
+
+            response = self.client.get('/api/?fields=zone, pod_name')
+            self.assertEqual(json.loads(response.data), {'zone': 'value-zone', 'pod_name': 'value-pod_name'})
+            self.assertEqual(response.mimetype, 'application/json')
+            response = self.client.get('/api/?fields=zone,pod_name',
+                                       headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get('/api/?fields=zone,timestamp')
+            self.assertEqual(response.headers['Cache-Control'], 'no-store')
+            self.assertEqual(mock_payload.build_payload.call_args.args[1], ('zone', 'timestamp'))
 
     def test_home_endpoint_without_prompt(self):
         """Test the home endpoint without a prompt"""
         with patch('app.whereami_payload') as mock_payload, \
-             patch('app._get_location_from_json_list') as mock_location:
+             patch('app.regions') as mock_regions:
             
-            mock_payload.build_payload.return_value = {
+            mock_payload.snapshot = {
                 'region': 'us-central1'
             }
-            mock_location.return_value = 'Iowa'
+            mock_regions.location.return_value = 'Iowa'
             
             response = self.client.get('/')
             self.assertEqual(response.status_code, 200)
             self.assertIn(b'Hello from us-central1', response.data)
 
+            # the rendered page is revalidated rather than re-rendered
+            etag = response.headers['ETag']
+            response = self.client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+            mock_payload.snapshot = {'zone': 'europe-west1-b'}
+            response = self.client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            mock_payload.build_payload.assert_not_called()
+
     def test_generate_endpoint_without_prompt(self):
         """Test the generate endpoint without a prompt parameter"""
         response = self.client.get('/generate')
@@ -86,6 +182,33 @@ class TestApp(unittest.TestCase):
         self.assertIn('error', data)
         self.assertEqual(data['error'], 'No prompt provided')
 
+    def test_payload_role_serves_payload_at_root(self):
+        """Test payload-only pods answer / with the payload and have no chat"""
+        with patch('app.role', 'http'), \
+             patch('app.whereami_payload') as mock_payload, \
+             patch('app.get_chat_service') as mock_chat:
+            mock_payload.build_payload_json.return_value = b'{"zone":"us-central1-a"}'
+            response = self.client.get('/?prompt=hello')
+            self.assertEqual(json.loads(response.data), {'zone': 'us-central1-a'})
+            response = self.client.get('/generate?prompt=hello')
+            self.assertEqual(response.status_code, 404)
+            mock_chat.assert_not_called()
+
+    def test_payload_role_skips_chat_imports(self):
+        """Test importing the app for a payload role doesn't load the LLM stack"""
+        import subprocess
+        env = dict(os.environ, WHEREAMI_ROLE='http', METADATA_RETRIES='0')
+        env.pop('PROJECT_ID', None)
+        # log lines go to stdout from a background thread and can split a
+        # print() there, so the answer goes to stderr
+        code = ("import sys, app; "
+                "print('loaded:', sorted(m for m in ('chat_service', 'langchain_google_vertexai', 'google.genai', "
+                "'google.cloud.compute_v1') if m in sys.modules), file=sys.stderr)")
+        result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('loaded: []', result.stderr.splitlines())
+
     def test_region_extraction_from_zone(self):
         """Test the _get_region helper function"""
         from app import _get_region
@@ -94,5 +217,200 @@ class TestApp(unittest.TestCase):
         self.assertEqual(_get_region('europe-west1-b'), 'europe-west1')
         self.assertEqual(_get_region('asia-east1-c'), 'asia-east1')
 
+    def test_regions_endpoints(self):
+        """Test the region catalog is served by name and by zone"""
+        response = self.client.get('/api/regions')
+        self.assertEqual(response.status_code, 200)
+        names = [item['name'] for item in json.loads(response.data)['regions']]
+        self.assertIn('us-central1', names)
+
+        response = self.client.get('/api/regions/us-central1-a')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['name'], 'us-central1')
+
+        response = self.client.get('/api/regions/nowhere1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_grpc_reply_from_payload(self):
+        """Test payload dicts convert to WhereamiReply, including fanned-out backends"""
+        from app import _to_reply
+
+        reply = _to_reply({
+            'zone': 'us-central1-a',
+            'host_header': None,
+            'headers': {'host': 'a'},
+            'backend_result': [
+                {'backend': 'b:9090', 'protocol': 'grpc', 'latency_ms': 1.5,
+                 'error': None, 'result': {'zone': 'us-east1-b', 'region': 'us-east1'}},
+                {'backend': 'c:9090', 'protocol': 'grpc', 'latency_ms': 10.0,
+                 'error': 'deadline exceeded', 'result': None}
+            ]
+        })
+        self.assertEqual(reply.zone, 'us-central1-a')
+        self.assertEqual(len(reply.backend_results), 2)
+        self.assertEqual(reply.backend_results[0].result.zone, 'us-east1-b')
+        self.assertEqual(reply.backend_results[1].error, 'deadline exceeded')
+
+    def test_grpc_reply_from_chained_fan_out(self):
+        """Test backends that fanned out themselves convert all the way down"""
+        from app import _to_reply
+
+        leaf = {'zone': 'asia-east1-a', 'headers': {'host': 'd'}}
+        reply = _to_reply({
+            'zone': 'us-central1-a',
+            # a single HTTP backend that called two backends of its own
+            'backend_result': {
+                'zone': 'us-east1-b',
+                'backend_result': [
+                    {'backend': 'c:9090', 'protocol': 'grpc', 'latency_ms': 1.0, 'error': None,
+                     'result': {'zone': 'europe-west1-b',
+                                'backend_result': [{'backend': 'd', 'protocol': 'http',
+                                                    'latency_ms': 2.0, 'error': None, 'result': leaf}]}},
+                    {'backend': 'e:9090', 'protocol': 'grpc', 'latency_ms': 3.0, 'error': None,
+                     'result': {'zone': 'us-west1-a', 'backend_result': leaf}}
+                ]
+            }
+        })
+        nested = reply.backend_result.backend_results
+        self.assertEqual(reply.backend_result.zone, 'us-east1-b')
+        self.assertEqual([r.result.zone for r in nested], ['europe-west1-b', 'us-west1-a'])
+        self.assertEqual(nested[0].result.backend_results[0].result.zone, 'asia-east1-a')
+        self.assertEqual(nested[1].result.backend_result.zone, 'asia-east1-a')
+
+    def test_watch_payload_changes_only(self):
+        """Test WatchPayload skips updates where only the timestamp moved"""
+        import app
+        import whereami_pb2
+
+        callbacks = []
+        context = MagicMock()
+        context.add_callback.side_effect = callbacks.append
+        payloads = iter([
+            {'zone': 'us-central1-a', 'timestamp': '2024-01-01T00:00:00'},
+            {'zone': 'us-central1-a', 'timestamp': '2024-01-01T00:00:01'},
+            {'zone': 'us-central1-b', 'timestamp': '2024-01-01T00:00:02'}
+        ])
+        with patch('app.whereami_payload') as mock_payload, \
+             patch('app.watch_min_interval', 0):
+            mock_payload.build_payload.side_effect = lambda headers, fields: next(payloads)
+            stream = app.WhereamigRPC().WatchPayload(
+                whereami_pb2.WatchRequest(interval_seconds=0.01, changes_only=True), context)
+
+            self.assertEqual(next(stream).zone, 'us-central1-a')
+            self.assertEqual(next(stream).zone, 'us-central1-b')
+            callbacks[0]()
+            self.assertEqual(list(stream), [])
+
+    def test_grpc_field_mask(self):
+        """Test GetPayload only builds and returns the masked fields"""
+        import app
+        import grpc
+        import whereami_pb2
+
+        request = whereami_pb2.PayloadRequest()
+        request.field_mask.paths.extend(['zone', 'backend_result.zone'])
+        with patch('app.whereami_payload') as mock_payload:
+            mock_payload.build_payload.return_value = {
+                'zone': 'us-central1-a',
+                'pod_name': 'whereami-1',
+                'backend_result': {'zone': 'us-east1-b', 'pod_name': 'backend-1'}
+            }
+            reply = app.WhereamigRPC().GetPayload(request, MagicMock())
+
+        self.assertEqual(mock_payload.build_payload.call_args.args[1], {'zone', 'backend_result'})
+        self.assertEqual(reply.zone, 'us-central1-a')
+        self.assertEqual(reply.pod_name, '')
+        self.assertEqual(reply.backend_result.zone, 'us-east1-b')
+        self.assertEqual(reply.backend_result.pod_name, '')
+
+        for paths in (['nope'], ['backend_results.error']):
+            context = MagicMock()
+            context.abort.side_effect = RuntimeError('aborted')
+            with self.assertRaises(RuntimeError):
+                app.WhereamigRPC().GetPayload(whereami_pb2.PayloadRequest(field_mask={'paths': paths}), context)
+            self.assertEqual(context.abort.call_args.args[0], grpc.StatusCode.INVALID_ARGUMENT)
+
+    def test_grpc_server_accepts_idle_keepalive_pings(self):
+        """Test a backend channel pinging between calls isn't sent GOAWAY too_many_pings"""
+        import time
+        import app
+        import grpc
+        import whereami_pb2
+        import whereami_pb2_grpc
+
+        port = _free_port()
+        with patch('app.whereami_payload') as mock_payload, \
+             patch('app.host_ip', '127.0.0.1'), \
+             patch('app.grpc_serving_port', port), \
+             patch('app.PromServerInterceptor', _PassThroughInterceptor), \
+             patch('app.grpc_min_ping_interval_ms', 500):
+            mock_payload.build_payload.return_value = {'zone': 'us-central1-a'}
+            server = app.grpc_server(start_metrics_server=False)
+            # pings like backend_clients.GrpcChannelCache, only faster
+            channel = grpc.insecure_channel('127.0.0.1:%d' % port, options=[
+                ('grpc.keepalive_time_ms', 1000),
+                ('grpc.keepalive_permit_without_calls', 1),
+                ('grpc.http2.max_pings_without_data', 0)])
+            try:
+                states = []
+                whereami_pb2_grpc.WhereamiStub(channel).GetPayload(whereami_pb2.PayloadRequest(), timeout=5)
+                channel.subscribe(states.append, try_to_connect=False)
+                time.sleep(3.5)
+                # a GOAWAY drops the channel back to IDLE
+                self.assertEqual(states[-1], grpc.ChannelConnectivity.READY)
+                self.assertNotIn(grpc.ChannelConnectivity.IDLE, states)
+            finally:
+                channel.close()
+                server.stop(None)
+
+    def test_watch_streams_dont_starve_get_payload(self):
+        """Test GetPayload is answered while the thread pool server has every stream slot taken"""
+        import app
+        import grpc
+        import whereami_pb2
+        import whereami_pb2_grpc
+
+        port = _free_port()
+        with patch('app.whereami_payload') as mock_payload, \
+             patch('app.host_ip', '127.0.0.1'), \
+             patch('app.grpc_serving_port', port), \
+             patch('app.PromServerInterceptor', _PassThroughInterceptor), \
+             patch('app.grpc_max_watch_streams', 8), \
+             patch('app.multiprocessing.cpu_count', return_value=1):
+            mock_payload.build_payload.return_value = {'zone': 'us-central1-a'}
+            server = app.grpc_server(start_metrics_server=False)
+            channel = grpc.insecure_channel('127.0.0.1:%d' % port)
+            stub = whereami_pb2_grpc.WhereamiStub(channel)
+            # more streams than the 6 threads answering unary calls
+            streams = [stub.WatchPayload(whereami_pb2.WatchRequest(interval_seconds=60), timeout=30) for _ in range(8)]
+            try:
+                for stream in streams:
+                    self.assertEqual(next(stream).zone, 'us-central1-a')
+                reply = stub.GetPayload(whereami_pb2.PayloadRequest(), timeout=5)
+                self.assertEqual(reply.zone, 'us-central1-a')
+
+                with self.assertRaises(grpc.RpcError) as raised:
+                    next(stub.WatchPayload(whereami_pb2.WatchRequest()))
+                self.assertEqual(raised.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+                # a closed stream gives its slot back
+                streams.pop().cancel()
+                stream = stub.WatchPayload(whereami_pb2.WatchRequest(interval_seconds=60), timeout=30)
+                for _ in range(50):
+                    try:
+                        next(stream)
+                        break
+                    except grpc.RpcError:
+                        stream = stub.WatchPayload(whereami_pb2.WatchRequest(interval_seconds=60), timeout=30)
+                        threading.Event().wait(0.1)
+                else:
+                    self.fail('stream slot was not released')
+                streams.append(stream)
+            finally:
+                for stream in streams:
+                    stream.cancel()
+                channel.close()
+                server.stop(None)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
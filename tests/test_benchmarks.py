@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the benchmark load generator and local stand-ins
+"""
+
+import unittest
+import json
+import os
+import sys
+import urllib.request
+from unittest.mock import patch
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import loadgen, standins
+
+class TestLoadgen(unittest.TestCase):
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(loadgen.percentile(values, 50), 50)
+        self.assertEqual(loadgen.percentile(values, 99), 99)
+        self.assertEqual(loadgen.percentile([7], 95), 7)
+        self.assertIsNone(loadgen.percentile([], 50))
+
+    def test_run_load_summary(self):
+        """Test a run reports requests, errors, throughput and percentiles in ms"""
+        calls = []
+        def make_client():
+            def request():
+                calls.append(1)
+                if len(calls) % 10 == 0:
+                    raise RuntimeError('backend down')
+            return request
+
+        result = loadgen.run_load('fake', make_client, concurrency=2, duration=0.2, warmup=0)
+
+        self.assertEqual(result['scenario'], 'fake')
+        self.assertEqual(result['concurrency'], 2)
+        self.assertGreater(result['requests'], 0)
+        self.assertGreater(result['errors'], 0)
+        self.assertAlmostEqual(result['throughput_rps'], result['requests'] / result['duration_s'],
+                               delta=result['throughput_rps'] * 0.01)
+        latency = result['latency_ms']
+        self.assertLessEqual(latency['p50'], latency['p95'])
+        self.assertLessEqual(latency['p95'], latency['p99'])
+        self.assertLessEqual(latency['p99'], latency['max'])
+        json.dumps(result)
+
+class TestStandins(unittest.TestCase):
+
+    def test_metadata_server(self):
+        """Test the metadata stand-in answers the way the payload builder expects"""
+        server = standins.start_metadata_server()
+        try:
+            url = 'http://127.0.0.1:%d/computeMetadata/v1/' % server.server_port
+            with patch('whereami_payload.METADATA_URL', url):
+                import whereami_payload
+                payload = whereami_payload.WhereamiPayload()
+                payload.stop_watching()
+                self.assertTrue(payload.wait_ready(10))
+            self.assertEqual(payload.snapshot['cluster_name'], 'bench-cluster')
+            self.assertEqual(payload.metadata_etag, 'bench-etag')
+
+            # the real metadata server refuses requests without the flavor header
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '?recursive=true', timeout=5)
+        finally:
+            server.stopping.set()
+            server.shutdown()
+
+    def test_stub_chat_model_streams(self):
+        """Test ChatService streams the stub model's canned answer"""
+        with patch.dict(os.environ, {'PROJECT_ID': 'bench-project', 'CHAT_CACHE_TTL': '0',
+                                     'BENCH_CHAT_TOKENS': '25', 'BENCH_CHAT_TOKEN_LATENCY': '0'}), \
+             patch('chat_service.ChatVertexAI', standins.StubChatModel):
+            from chat_service import ChatService
+            events = list(ChatService().stream_response('Hi', 'us-central1', 'Iowa'))
+
+        html = ''.join(json.loads(event[len('data: '):]).get('chunk', '') for event in events)
+        self.assertTrue(html.startswith('<p>word0 word1'))
+        self.assertIn('word24', html)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ChatService streaming
+"""
+
+import unittest
+import json
+import os
+import sys
+import time
+from unittest.mock import patch, MagicMock
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessageChunk
+
+class FakeStreamingModel:
+    """Streams canned rounds of message chunks, one round per stream() call"""
+
+    def __init__(self, rounds):
+        self.rounds = list(rounds)
+        self.calls = []
+
+    def stream(self, messages):
+        self.calls.append(list(messages))
+        for chunk in self.rounds.pop(0):
+            yield chunk
+
+def generations(path):
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value('whereami_chat_generations_total', {'path': path}) or 0
+
+def parse_events(stream):
+    return [json.loads(event[len('data: '):]) for event in stream]
+
+class TestChatServiceStreaming(unittest.TestCase):
+
+    def setUp(self):
+        """Build a ChatService without a real Vertex AI model"""
+        os.environ['PROJECT_ID'] = 'test-project'
+        with patch('chat_service.ChatVertexAI'):
+            from chat_service import ChatService
+            self.service = ChatService()
+
+    def test_streams_text_incrementally(self):
+        """Test text is sent as it arrives, with finished paragraphs appended once"""
+        self.service.langchain_llm = FakeStreamingModel([[
+            AIMessageChunk(content='Iowa is '),
+            AIMessageChunk(content='flat.\n\nIt has '),
+            AIMessageChunk(content='corn.')
+        ]])
+
+        events = parse_events(self.service.stream_response('Tell me about Iowa', 'us-central1', 'Iowa'))
+
+        self.assertEqual(events[0], {'chunk': '', 'tail': '<p>Iowa is </p>'})
+        self.assertEqual(events[1], {'chunk': '<p>Iowa is flat.</p>', 'tail': '<p>It has </p>'})
+        html = ''.join(event.get('chunk', '') for event in events)
+        self.assertEqual(html, '<p>Iowa is flat.</p><p>It has corn.</p>')
+
+    def test_runs_requested_tools(self):
+        """Test tool calls are announced, run, and fed back to the model"""
+        tool = MagicMock()
+        tool.invoke.return_value = '{"temp": 21}'
+        self.service.tools_by_name = {'get_current_weather': tool}
+        model = FakeStreamingModel([
+            [AIMessageChunk(content='', tool_call_chunks=[{
+                'name': 'get_current_weather', 'args': '{"location": "Iowa"}', 'id': 'call-1', 'index': 0}])],
+            [AIMessageChunk(content='It is 21C.')]
+        ])
+        self.service.langchain_llm = model
+
+        events = parse_events(self.service.stream_response('Weather in Iowa?', 'us-central1', 'Iowa'))
+
+        self.assertEqual(events[0], {'tool': 'get_current_weather'})
+        tool.invoke.assert_called_once_with({'location': 'Iowa'})
+        self.assertEqual(model.calls[1][-1].content, '{"temp": 21}')
+        self.assertEqual(events[-1]['chunk'], '<p>It is 21C.</p>')
+
+    def test_waiter_gets_an_error_when_the_leader_stalls(self):
+        """Test a coalesced request doesn't hang on a first client that stopped reading"""
+        self.service.langchain_llm = FakeStreamingModel([
+            [AIMessageChunk(content='Partial'), AIMessageChunk(content=' answer.')]
+        ])
+        self.service.response_cache.wait_timeout = 0.2
+
+        leader = self.service.stream_response('Hi', 'us-central1', 'Iowa')
+        next(leader)  # and never read again
+        try:
+            started = time.monotonic()
+            events = parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertEqual(len(events), 1)
+            self.assertTrue(events[0]['chunk'].startswith('Error: '))
+            self.assertIn('waiting', events[0]['chunk'])
+        finally:
+            leader.close()
+
+    def test_last_round_answers_without_tools(self):
+        """Test the model is made to answer once it has used up its tool rounds"""
+        from chat_service import MAX_TOOL_ROUNDS
+
+        tool = MagicMock()
+        tool.invoke.return_value = '{"temp": 21}'
+        self.service.tools_by_name = {'get_current_weather': tool}
+        tool_round = [AIMessageChunk(content='', tool_call_chunks=[{
+            'name': 'get_current_weather', 'args': '{}', 'id': 'call-1', 'index': 0}])]
+        self.service.langchain_llm = FakeStreamingModel([tool_round] * (MAX_TOOL_ROUNDS + 1))
+        self.service.llm = FakeStreamingModel([[AIMessageChunk(content='It is 21C.')]])
+
+        events = parse_events(self.service.stream_response('Weather in Iowa?', 'us-central1', 'Iowa'))
+
+        self.assertEqual(tool.invoke.call_count, MAX_TOOL_ROUNDS)
+        self.assertEqual(len(self.service.langchain_llm.calls), MAX_TOOL_ROUNDS)
+        self.assertEqual(len(self.service.llm.calls), 1)
+        self.assertEqual(events[-1]['chunk'], '<p>It is 21C.</p>')
+
+    def test_empty_answer_is_an_error_and_not_cached(self):
+        """Test a model that ends without any text gets an error event and is asked again next time"""
+        self.service.langchain_llm = FakeStreamingModel([
+            [AIMessageChunk(content='')],
+            [AIMessageChunk(content='Hello.')]
+        ])
+
+        events = parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0]['chunk'].startswith('Error: '))
+
+        events = parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))
+        self.assertEqual(events[-1]['chunk'], '<p>Hello.</p>')
+
+    def test_structured_fields_come_from_the_streamed_answer(self):
+        """Test the fields comment is parsed out of the same stream and never rendered"""
+        model = FakeStreamingModel([[
+            AIMessageChunk(content='Iowa grows **corn**.\n\n<!--where'),
+            AIMessageChunk(content='ami {"is_technical": false, "location_mentioned": "Iowa",'),
+            AIMessageChunk(content=' "sections": null} -->')
+        ]])
+        self.service.langchain_llm = model
+        structured = generations('structured')
+
+        events = parse_events(self.service.stream_response('Tell me about Iowa', 'us-central1', 'Iowa'))
+
+        fields = {'is_technical': False, 'location_mentioned': 'Iowa', 'sections': None}
+        self.assertEqual(events[-1], {'fields': fields})
+        self.assertNotIn('where', json.dumps(events[:-1]))
+        html = ''.join(event.get('chunk', '') for event in events)
+        self.assertEqual(html, '<p>Iowa grows <strong>corn</strong>.</p>')
+        self.assertEqual(generations('structured'), structured + 1)
+        self.assertEqual(len(model.calls), 1)
+
+        # a cached answer keeps its fields
+        events = parse_events(self.service.stream_response('Tell me about Iowa', 'us-central1', 'Iowa'))
+        self.assertEqual(events, [{'chunk': html}, {'fields': fields}])
+
+    def test_answer_without_fields_is_a_fallback(self):
+        """Test an answer with missing or malformed fields is still served, from the same call"""
+        model = FakeStreamingModel([
+            [AIMessageChunk(content='Iowa grows corn.')],
+            [AIMessageChunk(content='Iowa is flat.\n<!--whereami {"is_technical": "maybe"} -->')]
+        ])
+        self.service.langchain_llm = model
+        fallback = generations('fallback')
+
+        for prompt, answer in (('Iowa?', '<p>Iowa grows corn.</p>'), ('Iowa!?', '<p>Iowa is flat.</p>')):
+            events = parse_events(self.service.stream_response(prompt, 'us-central1', 'Iowa'))
+            self.assertEqual(''.join(event.get('chunk', '') for event in events), answer)
+            self.assertFalse(any('fields' in event for event in events))
+
+        self.assertEqual(generations('fallback'), fallback + 2)
+        self.assertEqual(len(model.calls), 2)
+
+    def test_tools_run_concurrently_with_timeout(self):
+        """Test a turn's tool calls run in parallel and slow tools are cut off"""
+        def slow_tool(seconds):
+            tool = MagicMock()
+            tool.invoke.side_effect = lambda args: time.sleep(seconds) or 'done'
+            return tool
+        self.service.tools_by_name = {'a': slow_tool(0.3), 'b': slow_tool(0.3), 'c': slow_tool(5)}
+        self.service.tool_timeout = 0.6
+
+        started = time.monotonic()
+        messages = self.service._run_tools([
+            {'name': 'a', 'args': {}, 'id': '1'},
+            {'name': 'b', 'args': {}, 'id': '2'},
+            {'name': 'c', 'args': {}, 'id': '3'}
+        ])
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual([m.tool_call_id for m in messages], ['1', '2', '3'])
+        self.assertEqual([m.content for m in messages[:2]], ['done', 'done'])
+        self.assertIn('timed out', messages[2].content)
+
+    def test_streamed_answer_is_cached(self):
+        """Test a repeated prompt is answered from cache in a single event"""
+        model = FakeStreamingModel([[AIMessageChunk(content='Hello.')]])
+        self.service.langchain_llm = model
+
+        parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))
+        events = parse_events(self.service.stream_response(' hi ', 'us-central1', 'Iowa'))
+
+        self.assertEqual(events, [{'chunk': '<p>Hello.</p>'}])
+        self.assertEqual(len(model.calls), 1)
+
+    def test_abandoned_stream_is_not_cached(self):
+        """Test a stream closed by the client doesn't leave a partial answer behind"""
+        self.service.langchain_llm = FakeStreamingModel([
+            [AIMessageChunk(content='Partial'), AIMessageChunk(content=' answer.')],
+            [AIMessageChunk(content='Full answer.')]
+        ])
+
+        stream = self.service.stream_response('Hi', 'us-central1', 'Iowa')
+        next(stream)
+        stream.close()
+
+        events = parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))
+        self.assertEqual(events[-1]['chunk'], '<p>Full answer.</p>')
+
+    def test_waiter_gets_an_error_when_the_leader_disconnects(self):
+        """Test a coalesced request is sent an error event, not GeneratorExit, when the first client leaves"""
+        import threading
+        from prometheus_client import REGISTRY
+
+        self.service.langchain_llm = FakeStreamingModel([
+            [AIMessageChunk(content='Partial'), AIMessageChunk(content=' answer.')]
+        ])
+        labels = {'cache': 'chat', 'result': 'coalesced'}
+        coalesced = REGISTRY.get_sample_value('whereami_response_cache_requests_total', labels) or 0
+
+        leader = self.service.stream_response('Hi', 'us-central1', 'Iowa')
+        next(leader)
+        events = []
+        waiter = threading.Thread(target=lambda: events.extend(
+            parse_events(self.service.stream_response('Hi', 'us-central1', 'Iowa'))))
+        waiter.start()
+        deadline = time.monotonic() + 5
+        while REGISTRY.get_sample_value('whereami_response_cache_requests_total', labels) == coalesced:
+            self.assertLess(time.monotonic(), deadline, 'second request never joined the first')
+            time.sleep(0.01)
+
+        leader.close()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0]['chunk'].startswith('Error: '))
+
+if __name__ == '__main__':
+    unittest.main()
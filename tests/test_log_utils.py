@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Unit tests for log deduplication, rate limiting and the queued stream handler
+"""
+
+import unittest
+import io
+import logging
+import os
+import sys
+from unittest.mock import patch
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_utils
+
+def make_record(msg, level=logging.WARNING):
+    return logging.LogRecord('whereami', level, __file__, 1, msg, None, None)
+
+class TestLogUtils(unittest.TestCase):
+
+    def test_log_once(self):
+        """Test a repeated message is only logged the first time"""
+        with patch.object(log_utils, '_logged_once', set()), \
+             patch('log_utils.logging.log') as log:
+            for _ in range(3):
+                log_utils.log_once(logging.WARNING, "Unable to capture node name.")
+            log_utils.log_once(logging.WARNING, "Unable to capture pod IP address.")
+        self.assertEqual(log.call_count, 2)
+
+    def test_rate_limit_suppresses_and_reports(self):
+        """Test repeats past the limit are dropped and counted once the window rolls over"""
+        limiter = log_utils.RateLimitFilter(limit=2, interval=60)
+        with patch('log_utils.time.monotonic', return_value=1000):
+            passed = [limiter.filter(make_record("backend down")) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+
+        record = make_record("backend down")
+        with patch('log_utils.time.monotonic', return_value=1061):
+            self.assertTrue(limiter.filter(record))
+        self.assertEqual(record.getMessage(), "backend down (3 similar messages suppressed)")
+
+    def test_rate_limit_accepts_unhashable_messages(self):
+        """Test records whose msg is a dict or list are limited like strings instead of raising"""
+        limiter = log_utils.RateLimitFilter(limit=1, interval=60)
+        self.assertEqual([limiter.filter(make_record({'error': 'backend down'})) for _ in range(2)], [True, False])
+        self.assertTrue(limiter.filter(make_record(['backend down'])))
+
+    def test_rate_limit_ignores_info(self):
+        """Test records below WARNING are never limited"""
+        limiter = log_utils.RateLimitFilter(limit=1, interval=60)
+        self.assertTrue(all(limiter.filter(make_record("hello", logging.INFO)) for _ in range(5)))
+
+    def test_queue_handler_writes_in_background(self):
+        """Test records reach the stream once the listener drains the queue"""
+        stream = io.StringIO()
+        handler = log_utils.QueueStreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        logger = logging.getLogger('test_log_utils')
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.warning("pod %s ready", "whereami-1")
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(stream.getvalue(), "WARNING pod whereami-1 ready\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the whereami payload builder
+"""
+
+import asyncio
+import json
+import unittest
+import os
+import sys
+import threading
+import time
+from types import MappingProxyType
+from unittest.mock import patch, MagicMock
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GCE_METADATA = {
+    'project': {'projectId': 'test-project'},
+    'instance': {
+        'zone': 'projects/123/zones/us-central1-a',
+        'id': 1234567890,
+        'attributes': {'cluster-name': 'test-cluster'},
+        'serviceAccounts': {'default': {'email': 'sa@test-project.iam.gserviceaccount.com'}}
+    }
+}
+
+class TestWhereamiPayload(unittest.TestCase):
+
+    def setUp(self):
+        """Build a payload object against mocked GCE metadata"""
+        for var in ('BACKEND_ENABLED', 'ECHO_HEADERS', 'GRPC_ENABLED'):
+            os.environ.pop(var, None)
+        os.environ['METADATA'] = 'frontend'
+
+        with patch('whereami_payload.requests.Session') as mock_session:
+            response = MagicMock()
+            response.ok = True
+            response.headers = {}
+            response.json.return_value = GCE_METADATA
+            mock_session.return_value.get.return_value = response
+
+            import whereami_payload
+            self.whereami_payload = whereami_payload.WhereamiPayload()
+            self.assertTrue(self.whereami_payload.wait_ready(5))
+
+    def test_snapshot_is_read_only(self):
+        """Test the static snapshot can't be mutated by request handlers"""
+        snapshot = self.whereami_payload.snapshot
+        self.assertEqual(snapshot['project_id'], 'test-project')
+        self.assertEqual(snapshot['zone'], 'us-central1-a')
+        self.assertEqual(snapshot['cluster_name'], 'test-cluster')
+        self.assertEqual(snapshot['metadata'], 'frontend')
+        with self.assertRaises(TypeError):
+            snapshot['zone'] = 'us-east1-b'
+
+    def test_metadata_is_fetched_in_the_background(self):
+        """Test construction returns before GCE metadata arrives and the snapshot fills in later"""
+        import whereami_payload
+        release = threading.Event()
+        def slow_get(*args, **kwargs):
+            release.wait(5)
+            response = MagicMock()
+            response.ok = True
+            response.headers = {}
+            response.json.return_value = GCE_METADATA
+            return response
+
+        with patch('whereami_payload.requests.Session') as mock_session:
+            mock_session.return_value.get.side_effect = slow_get
+            payload = whereami_payload.WhereamiPayload()
+            self.assertFalse(payload.is_ready())
+            self.assertEqual(dict(payload.snapshot), {})
+            release.set()
+            self.assertTrue(payload.wait_ready(5))
+        self.assertEqual(payload.snapshot['zone'], 'us-central1-a')
+        self.assertEqual(mock_session.return_value.get.call_args.kwargs['timeout'], payload.metadata_timeout)
+
+    def test_snapshot_follows_metadata_changes(self):
+        """Test the watcher long-polls with the last ETag and swaps in a new snapshot on change"""
+        import copy
+        import whereami_payload
+        changed = copy.deepcopy(GCE_METADATA)
+        changed['instance']['attributes']['cluster-name'] = 'renamed-cluster'
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def metadata_get(url, params=None, **kwargs):
+            response = MagicMock()
+            response.ok = True
+            if params is None:
+                response.headers = {'ETag': 'etag-1'}
+                response.json.return_value = GCE_METADATA
+            elif params['last_etag'] == 'etag-1':
+                response.headers = {'ETag': 'etag-2'}
+                response.json.return_value = changed
+            else:
+                # nothing else changes; hold the long poll open
+                blocked.set()
+                release.wait(5)
+                response.headers = {'ETag': params['last_etag']}
+            return response
+
+        with patch('whereami_payload.requests.Session') as mock_session:
+            mock_session.return_value.get.side_effect = metadata_get
+            payload = whereami_payload.WhereamiPayload()
+            self.assertTrue(blocked.wait(5))
+            payload.stop_watching()
+            release.set()
+
+        self.assertEqual(payload.snapshot['cluster_name'], 'renamed-cluster')
+        self.assertEqual(payload.metadata_etag, 'etag-2')
+        watch_params = mock_session.return_value.get.call_args_list[1].kwargs['params']
+        self.assertEqual(watch_params['wait_for_change'], 'true')
+
+    def test_build_payload_overlays_request_fields(self):
+        """Test per-request fields are layered over the snapshot"""
+        payload = self.whereami_payload.build_payload({'host': 'whereami.example.com'})
+        self.assertEqual(payload['host_header'], 'whereami.example.com')
+        self.assertIn('timestamp', payload)
+        self.assertEqual(payload['zone'], 'us-central1-a')
+        self.assertNotIn('host_header', self.whereami_payload.snapshot)
+
+    def test_build_payload_does_not_share_state(self):
+        """Test echoed headers from one request don't leak into another"""
+        self.whereami_payload.echo_headers = True
+        first = self.whereami_payload.build_payload({'host': 'a', 'x-first': '1'})
+        second = self.whereami_payload.build_payload({'host': 'b'})
+        self.assertIsNot(first, second)
+        self.assertEqual(first['headers'], {'host': 'a', 'x-first': '1'})
+        self.assertEqual(second['headers'], {'host': 'b'})
+
+    def test_build_payload_json_matches_build_payload(self):
+        """Test the spliced JSON encoding decodes to the same payload, with or without orjson"""
+        import fast_json
+        self.whereami_payload.echo_headers = True
+        headers = {'host': 'whereami.example.com'}
+        for encoder in (fast_json.orjson, None):
+            with patch('fast_json.orjson', encoder):
+                self.whereami_payload.snapshot = self.whereami_payload.snapshot
+                encoded = self.whereami_payload.build_payload_json(headers)
+            expected = self.whereami_payload.build_payload(headers)
+            decoded = json.loads(encoded)
+            self.assertIsInstance(decoded.pop('timestamp'), str)
+            del expected['timestamp']
+            self.assertEqual(decoded, expected)
+
+        self.assertEqual(fast_json.splice(fast_json.encode_prefix({}), {'a': 1}), b'{"a":1}')
+        self.assertEqual(fast_json.splice(fast_json.encode_prefix({'a': 1}), {}), b'{"a":1}')
+
+    def test_field_etags_follow_values(self):
+        """Test static fields get ETags that only change with their value"""
+        payload = self.whereami_payload
+        zone_etag = payload.field_etag('zone')
+        cluster_etag = payload.field_etag('cluster_name')
+        self.assertIsNone(payload.field_etag('timestamp'))
+
+        payload.snapshot = MappingProxyType(dict(payload.snapshot, cluster_name='renamed-cluster'))
+        self.assertEqual(payload.field_etag('zone'), zone_etag)
+        self.assertNotEqual(payload.field_etag('cluster_name'), cluster_etag)
+
+    def test_static_fields_come_from_one_snapshot(self):
+        """Test values and ETags are read together, and only for snapshot fields"""
+        payload = self.whereami_payload
+        values, etags = payload.static_fields(('zone', 'cluster_name'))
+        self.assertEqual(values, {'zone': payload.snapshot['zone'],
+                                  'cluster_name': payload.snapshot['cluster_name']})
+        self.assertEqual(etags, [payload.field_etag('zone'), payload.field_etag('cluster_name')])
+        self.assertIsNone(payload.static_fields(('zone', 'timestamp')))
+
+        # a later swap that drops a field doesn't touch what was already read
+        payload.snapshot = MappingProxyType({name: value for name, value in payload.snapshot.items()
+                                             if name != 'cluster_name'})
+        self.assertEqual(values['cluster_name'], 'test-cluster')
+        self.assertIsNone(payload.static_fields(('cluster_name',)))
+
+    def test_field_selection_skips_backends(self):
+        """Test backends are only called when the caller asks for backend_result"""
+        self.whereami_payload.backend_enabled = True
+        self.whereami_payload.backend_service = 'http://backend'
+        with patch.object(self.whereami_payload, 'call_backends',
+                          return_value=[{'protocol': 'http', 'result': {'zone': 'b'}}]) as call_backends:
+            payload = self.whereami_payload.build_payload({'host': 'a'}, fields=('zone', 'timestamp'))
+            self.assertEqual(set(payload), {'zone', 'timestamp'})
+            call_backends.assert_not_called()
+
+            payload = self.whereami_payload.build_payload({'host': 'a'}, fields=('backend_result',))
+            self.assertEqual(payload, {'backend_result': {'zone': 'b'}})
+            call_backends.assert_called_once()
+
+    def test_parse_backends(self):
+        """Test BACKEND_SERVICE lists are split by protocol"""
+        self.whereami_payload.backend_service = 'http://a, grpc://b:9090,c:9090'
+        self.assertEqual(self.whereami_payload.parse_backends(),
+                         [('http', 'http://a'), ('grpc', 'b:9090'), ('http', 'c:9090')])
+        self.whereami_payload.grpc_enabled = True
+        self.assertEqual(self.whereami_payload.parse_backends()[2], ('grpc', 'c:9090'))
+
+    def test_fan_out_enforces_deadline(self):
+        """Test a slow backend is reported as timed out without holding up the rest"""
+        def fake_call(protocol, target, forward_headers):
+            if target == 'http://slow':
+                time.sleep(1)
+            return {'backend': target, 'protocol': protocol, 'latency_ms': 1.0,
+                    'error': None, 'result': {'zone': target}}
+
+        self.whereami_payload.backend_enabled = True
+        self.whereami_payload.backend_service = 'http://fast,http://slow'
+        self.whereami_payload.backend_deadline = 0.2
+        with patch.object(self.whereami_payload, 'call_backend', side_effect=fake_call):
+            started = time.monotonic()
+            payload = self.whereami_payload.build_payload({'host': 'a'})
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.9)
+        fast, slow = payload['backend_result']
+        self.assertEqual(fast['result'], {'zone': 'http://fast'})
+        self.assertIsNone(fast['error'])
+        self.assertEqual(slow['error'], 'deadline exceeded')
+        self.assertIsNone(slow['result'])
+
+    def test_build_payload_async_matches_sync(self):
+        """Test the asyncio payload builder applies the same deadline handling"""
+        async def fake_call(protocol, target, forward_headers):
+            if target == 'slow:9090':
+                await asyncio.sleep(1)
+            return {'backend': target, 'protocol': protocol, 'latency_ms': 1.0,
+                    'error': None, 'result': {'zone': target}}
+
+        self.whereami_payload.backend_enabled = True
+        self.whereami_payload.grpc_enabled = True
+        self.whereami_payload.backend_service = 'fast:9090,slow:9090'
+        self.whereami_payload.backend_deadline = 0.2
+        with patch.object(self.whereami_payload, 'call_backend_async', side_effect=fake_call):
+            payload = asyncio.run(self.whereami_payload.build_payload_async(None))
+
+        fast, slow = payload['backend_result']
+        self.assertEqual(fast['result'], {'zone': 'fast:9090'})
+        self.assertEqual(slow['error'], 'deadline exceeded')
+        self.assertEqual(payload['zone'], 'us-central1-a')
+
+class TestHttpBackendClient(unittest.TestCase):
+
+    def test_timeouts_and_pool_size_from_env(self):
+        """Test the pooled client picks up its limits from the environment"""
+        with patch.dict(os.environ, {'BACKEND_POOL_SIZE': '4',
+                                     'BACKEND_CONNECT_TIMEOUT': '0.5',
+                                     'BACKEND_READ_TIMEOUT': '2'}):
+            from backend_clients import HttpBackendClient
+            client = HttpBackendClient()
+        self.assertEqual(client.pool_size, 4)
+        self.assertEqual(client.timeout, (0.5, 2.0))
+        self.assertEqual(client.pool_stats(),
+                         {'connections_opened': 0, 'requests': 0, 'connections_reused': 0})
+
+    def test_get_json_passes_timeout(self):
+        """Test backend calls always carry a timeout"""
+        from backend_clients import HttpBackendClient
+        client = HttpBackendClient()
+        response = MagicMock()
+        response.ok = True
+        response.json.return_value = {'zone': 'us-central1-a'}
+        with patch.object(client.session, 'get', return_value=response) as mock_get:
+            result = client.get_json('http://whereami-backend', headers={'x-request-id': 'abc'})
+        self.assertEqual(result, {'zone': 'us-central1-a'})
+        mock_get.assert_called_once_with('http://whereami-backend',
+                                         headers={'x-request-id': 'abc'},
+                                         timeout=client.timeout)
+
+class TestGrpcChannelCache(unittest.TestCase):
+
+    def test_channels_are_reused_per_target(self):
+        """Test a channel is opened once per target and credentials"""
+        from backend_clients import GrpcChannelCache
+        cache = GrpcChannelCache()
+        with patch('backend_clients.grpc.insecure_channel') as mock_channel:
+            first = cache.get_stub('whereami-backend:9090')
+            second = cache.get_stub('whereami-backend:9090')
+        self.assertIs(first, second)
+        mock_channel.assert_called_once()
+        self.assertEqual(cache.channel_count(), 1)
+        cache.close()
+        self.assertEqual(cache.channel_count(), 0)
+
+    def test_lb_policy_per_target(self):
+        """Test per-target load balancing overrides the default policy"""
+        from backend_clients import GrpcChannelCache
+        cache = GrpcChannelCache(lb_policy='pick_first,whereami-backend:9090=round_robin')
+        options = dict(cache._channel_options('whereami-backend:9090'))
+        self.assertIn('round_robin', options['grpc.service_config'])
+        options = dict(cache._channel_options('other-backend:9090'))
+        self.assertIn('pick_first', options['grpc.service_config'])
+
+if __name__ == '__main__':
+    unittest.main()
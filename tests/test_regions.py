@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the region catalog
+"""
+
+import unittest
+import json
+import os
+import sys
+import tempfile
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from region_catalog import RegionCatalog
+
+class TestRegionCatalog(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small catalog to a temp file"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'regions.json')
+        self._write([{'name': 'us-central1', 'location': 'Council Bluffs, Iowa'}])
+        self.catalog = RegionCatalog(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, regions, mtime=None):
+        with open(self.path, 'w') as file:
+            json.dump({'regions': regions}, file)
+        if mtime:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_lookup_by_region_and_zone(self):
+        """Test regions resolve by name and by zone"""
+        self.assertEqual(self.catalog.location('us-central1'), 'Council Bluffs, Iowa')
+        self.assertEqual(self.catalog.location('us-central1-f'), 'Council Bluffs, Iowa')
+        self.assertIsNone(self.catalog.location('us-east1'))
+        self.assertIsNone(self.catalog.location('unknown'))
+        with self.assertRaises(TypeError):
+            self.catalog.get('us-central1')['location'] = 'Elsewhere'
+
+    def test_reloads_when_file_changes(self):
+        """Test the catalog is re-read only after the file's mtime changes"""
+        self.assertEqual(len(self.catalog.all()), 1)
+        index = self.catalog._index
+        self.catalog.all()
+        self.assertIs(self.catalog._index, index)
+
+        self._write([{'name': 'us-central1', 'location': 'Council Bluffs, Iowa'},
+                     {'name': 'us-east1', 'location': 'Moncks Corner, South Carolina'}],
+                    mtime=os.stat(self.path).st_mtime + 10)
+        self.assertEqual(self.catalog.location('us-east1-b'), 'Moncks Corner, South Carolina')
+        self.assertEqual([r['name'] for r in self.catalog.all()], ['us-central1', 'us-east1'])
+
+    def test_keeps_last_copy_on_bad_file(self):
+        """Test a broken or missing file doesn't empty a loaded catalog"""
+        self.catalog.all()
+        with open(self.path, 'w') as file:
+            file.write('{not json')
+        os.utime(self.path, (1, 1))
+        self.assertEqual(self.catalog.location('us-central1'), 'Council Bluffs, Iowa')
+        os.remove(self.path)
+        self.assertEqual(self.catalog.location('us-central1'), 'Council Bluffs, Iowa')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the chat response cache
+"""
+
+import unittest
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache, normalize_prompt
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_normalize_prompt(self):
+        """Test whitespace and case differences share a key"""
+        self.assertEqual(normalize_prompt('  What is an  interesting fact\nabout Iowa? '),
+                         normalize_prompt('what is an interesting fact about iowa?'))
+
+    def test_hit_after_miss(self):
+        """Test a cached value is returned without calling compute again"""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        calls = []
+        compute = lambda: calls.append(1) or 'answer'
+        self.assertEqual(cache.get_or_compute('k', compute), 'answer')
+        self.assertEqual(cache.get_or_compute('k', compute), 'answer')
+        self.assertEqual(len(calls), 1)
+
+    def test_ttl_expiry(self):
+        """Test entries are recomputed once their TTL has passed"""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        cache.get_or_compute('k', lambda: 'old')
+        with patch('response_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(cache.get_or_compute('k', lambda: 'new'), 'new')
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted when the cache is full"""
+        cache = ResponseCache(ttl=60, max_entries=2)
+        cache.get_or_compute('a', lambda: 'a')
+        cache.get_or_compute('b', lambda: 'b')
+        cache.get_or_compute('a', lambda: 'unused')
+        cache.get_or_compute('c', lambda: 'c')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_compute('a', lambda: 'recomputed'), 'a')
+        self.assertEqual(cache.get_or_compute('b', lambda: 'recomputed'), 'recomputed')
+
+    def test_errors_are_not_cached(self):
+        """Test a failed call is retried on the next lookup"""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        def fail():
+            raise RuntimeError('model unavailable')
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute('k', fail)
+        self.assertEqual(cache.get_or_compute('k', lambda: 'answer'), 'answer')
+
+    def test_concurrent_misses_coalesce(self):
+        """Test concurrent lookups of the same key make a single call"""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        release = threading.Event()
+        calls = []
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return 'answer'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['answer'] * 8)
+
+    def test_abandoned_call_fails_waiters_with_an_error(self):
+        """Test waiters get an ordinary exception when the computing caller is interrupted"""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        _, leader = cache.claim('k')
+        state, waiter = cache.claim('k')
+        self.assertEqual(state, 'wait')
+
+        cache.fail('k', leader, GeneratorExit())
+        with self.assertRaises(RuntimeError):
+            waiter.result()
+        self.assertEqual(cache.claim('k')[0], 'lead')
+
+    def test_waiters_time_out(self):
+        """Test a waiter gives up on a caller that never finishes"""
+        cache = ResponseCache(ttl=60, max_entries=10, wait_timeout=0.1)
+        cache.claim('k')
+        state, pending = cache.claim('k')
+        self.assertEqual(state, 'wait')
+        with self.assertRaises(TimeoutError):
+            cache.wait(pending)
+
+    def test_disabled(self):
+        """Test a zero TTL turns the cache off"""
+        cache = ResponseCache(ttl=0, max_entries=10)
+        cache.get_or_compute('k', lambda: 'a')
+        self.assertEqual(cache.get_or_compute('k', lambda: 'b'), 'b')
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
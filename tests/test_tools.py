@@ -7,6 +7,9 @@ import unittest
 import json
 import os
 import sys
+import tempfile
+import threading
+import time
 from unittest.mock import patch, MagicMock
 
 # Add parent directory to path to import tool modules
@@ -78,8 +81,107 @@ class TestGCPTools(unittest.TestCase):
         self.assertIn('available_services', data)
         self.assertLessEqual(data['service_count'], 5)
 
+class TestGCPCaching(unittest.TestCase):
+
+    def test_clients_are_shared(self):
+        """Test API clients are built once and reused"""
+        from gcp_tools import get_client
+        client_class = MagicMock()
+        self.assertIs(get_client(client_class), get_client(client_class))
+        client_class.assert_called_once_with()
+
+    def test_fresh_entries_skip_the_loader(self):
+        """Test a cached value is reused until it expires"""
+        from gcp_tools import RefreshingCache
+        cache = RefreshingCache(ttl=60)
+        loader = MagicMock(return_value=['us-central1'])
+        cache.get('regions', loader)
+        self.assertEqual(cache.get('regions', loader), ['us-central1'])
+        loader.assert_called_once()
+
+    def test_stale_entries_refresh_in_background(self):
+        """Test an expired value is served while it is refreshed"""
+        from gcp_tools import RefreshingCache
+        cache = RefreshingCache(ttl=0.01)
+        cache.get('regions', lambda: ['old'])
+        time.sleep(0.02)
+        refreshed = threading.Event()
+        def loader():
+            refreshed.set()
+            return ['new']
+        self.assertEqual(cache.get('regions', loader), ['old'])
+        self.assertTrue(refreshed.wait(5))
+        for _ in range(100):
+            if cache.get('regions', loader) == ['new']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('regions', loader), ['new'])
+
+    def test_failed_refresh_keeps_stale_value(self):
+        """Test API errors during a refresh fall back to the cached value"""
+        from gcp_tools import RefreshingCache
+        cache = RefreshingCache(ttl=0.01, retry_after=60)
+        cache.get('regions', lambda: ['old'])
+        time.sleep(0.02)
+        failing = MagicMock(side_effect=RuntimeError('API unavailable'))
+        self.assertEqual(cache.get('regions', failing), ['old'])
+        for _ in range(100):
+            if not cache._refreshing:
+                break
+            time.sleep(0.01)
+        # the failed key isn't retried on every call
+        self.assertEqual(cache.get('regions', failing), ['old'])
+        failing.assert_called_once()
+
+    def test_bulk_region_info_uses_one_zone_listing(self):
+        """Test zones for several regions come from a single zones listing"""
+        from gcp_tools import RefreshingCache, get_gcp_regions_info
+        os.environ['PROJECT_ID'] = 'test-project'
+
+        zones = []
+        for name in ('us-central1-b', 'us-central1-a', 'europe-west1-b'):
+            zone = MagicMock()
+            zone.name = name
+            zone.region = 'projects/test-project/regions/' + name.rsplit('-', 1)[0]
+            zones.append(zone)
+
+        def get_region(project, region):
+            info = MagicMock()
+            info.name = region
+            info.description = region
+            info.status = 'UP'
+            info.quotas = []
+            return info
+
+        with patch('gcp_tools.gcp_cache', RefreshingCache(ttl=60)), \
+             patch('gcp_tools.compute_v1.RegionsClient') as mock_regions, \
+             patch('gcp_tools.compute_v1.ZonesClient') as mock_zones:
+            mock_regions.return_value.get.side_effect = get_region
+            mock_zones.return_value.list.return_value = zones
+            result = json.loads(get_gcp_regions_info.func(['us-central1', 'europe-west1', 'asia-east1']))
+
+        mock_zones.return_value.list.assert_called_once_with(project='test-project')
+        self.assertEqual([r['zones'] for r in result['regions']],
+                         [['us-central1-a', 'us-central1-b'], ['europe-west1-b'], []])
+
 class TestWeatherTools(unittest.TestCase):
     
+    def setUp(self):
+        """Give each test empty weather caches"""
+        import weather_tools
+        from response_cache import ResponseCache
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'geocode.sqlite3')
+        patches = [
+            patch('weather_tools.geocode_cache', weather_tools.GeocodeCache(self.db_path)),
+            patch('weather_tools.current_weather_cache', ResponseCache(ttl=60, max_entries=10, name='test')),
+            patch('weather_tools.forecast_cache', ResponseCache(ttl=60, max_entries=10, name='test'))
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+
     def test_get_current_weather_no_api_key(self):
         """Test weather API when no API key is configured"""
         # Ensure no API key is set
@@ -94,7 +196,7 @@ class TestWeatherTools(unittest.TestCase):
         self.assertIn('note', data)
         self.assertIn('mock data', data['note'])
 
-    @patch('weather_tools.requests.get')
+    @patch('weather_tools.weather_session.get')
     def test_get_current_weather_with_api(self, mock_get):
         """Test weather API with mocked successful response"""
         os.environ['OPENWEATHER_API_KEY'] = 'test-key'
@@ -142,6 +244,89 @@ class TestWeatherTools(unittest.TestCase):
         self.assertEqual(data['temperature']['celsius'], 20)
         self.assertIn('clear sky', data['condition'].lower())
 
+    @patch('weather_tools.weather_session.get')
+    def test_weather_lookups_are_cached(self, mock_get):
+        """Test repeat calls skip geocoding and reuse recent weather"""
+        os.environ['OPENWEATHER_API_KEY'] = 'test-key'
+        geo_response = MagicMock()
+        geo_response.json.return_value = [{'name': 'London', 'country': 'GB', 'lat': 51.5, 'lon': -0.12}]
+        weather_response = MagicMock()
+        weather_response.json.return_value = {
+            'main': {'temp': 12, 'feels_like': 10, 'humidity': 80, 'pressure': 1000},
+            'weather': [{'description': 'light rain'}],
+            'wind': {'speed': 5},
+            'clouds': {'all': 90}
+        }
+        mock_get.side_effect = lambda url, **kwargs: geo_response if 'geo' in url else weather_response
+
+        from weather_tools import get_current_weather
+        first = json.loads(get_current_weather.func('London, UK'))
+        second = json.loads(get_current_weather.func('  london, uk'))
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get.call_count, 2)
+
+    def test_geocodes_persist_across_restarts(self):
+        """Test geocoded locations are read back from the SQLite file"""
+        from weather_tools import GeocodeCache
+        GeocodeCache(self.db_path).put('Tokyo', {'lat': 35.7, 'lon': 139.7, 'name': 'Tokyo', 'country': 'JP'})
+        self.assertEqual(GeocodeCache(self.db_path).get('tokyo'),
+                         {'lat': 35.7, 'lon': 139.7, 'name': 'Tokyo', 'country': 'JP'})
+        self.assertIsNone(GeocodeCache(self.db_path).get('Osaka'))
+
+    def test_unusable_geocode_file_falls_back_to_memory(self):
+        """Test a geocode file that can't be opened is given up on after the first try"""
+        import sqlite3
+        from weather_tools import GeocodeCache
+        cache = GeocodeCache(os.path.join(self.tmpdir.name, 'geocode.sqlite3'))
+        place = {'lat': 35.7, 'lon': 139.7, 'name': 'Tokyo', 'country': 'JP'}
+        with patch('weather_tools.sqlite3.connect',
+                   side_effect=sqlite3.OperationalError('unable to open database file')) as mock_connect, \
+             self.assertLogs(level='WARNING') as logs:
+            self.assertIsNone(cache.get('Osaka'))
+            self.assertIsNone(cache.get('Kyoto'))
+            cache.put('Tokyo', place)
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(cache.get('tokyo'), place)
+
+    def test_identical_requests_are_coalesced(self):
+        """Test concurrent identical API requests share one outbound call"""
+        import weather_tools
+        release = threading.Event()
+        response = MagicMock()
+        response.json.return_value = {'ok': True}
+        def slow_get(url, **kwargs):
+            release.wait(5)
+            return response
+
+        results = []
+        with patch.object(weather_tools.weather_session, 'get', side_effect=slow_get) as mock_get:
+            threads = [threading.Thread(target=lambda: results.append(
+                weather_tools.get_json('http://api.example/weather', {'lat': 1, 'lon': 2})))
+                for _ in range(5)]
+            for t in threads:
+                t.start()
+            time.sleep(0.2)
+            release.set()
+            for t in threads:
+                t.join(5)
+
+        mock_get.assert_called_once()
+        self.assertEqual(results, [{'ok': True}] * 5)
+
+    def test_rate_limiter_waits_for_tokens(self):
+        """Test calls beyond the per-minute budget wait for the bucket to refill"""
+        from weather_tools import RateLimiter
+        limiter = RateLimiter(per_minute=2)
+        with patch('weather_tools.time.sleep') as mock_sleep:
+            limiter.acquire()
+            limiter.acquire()
+            mock_sleep.assert_not_called()
+            mock_sleep.side_effect = lambda seconds: setattr(limiter, '_tokens', 1)
+            limiter.acquire()
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 30, delta=1)
+
     def test_get_weather_forecast_no_api_key(self):
         """Test weather forecast when no API key is configured"""
         if 'OPENWEATHER_API_KEY' in os.environ:
@@ -1,9 +1,215 @@
 import logging
 import os
 import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
 from typing import Dict, Optional
 from langchain_core.tools import tool
+from response_cache import ResponseCache, normalize_prompt
+
+class RateLimiter:
+    """Token bucket allowing a number of calls per minute, blocking callers until a token is free"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(per_minute, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# one keep-alive pool for every OpenWeatherMap call; 429s and transient errors
+# are retried, honouring Retry-After
+weather_session = requests.Session()
+weather_session.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.environ.get("WEATHER_MAX_CONCURRENT_REQUESTS", 4)),
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504],
+                      allowed_methods=["GET"], respect_retry_after_header=True, raise_on_status=False)
+))
+
+# stay inside the API plan's limits (the free tier allows 60 calls a minute)
+_request_slots = threading.BoundedSemaphore(int(os.environ.get("WEATHER_MAX_CONCURRENT_REQUESTS", 4)))
+rate_limiter = RateLimiter(int(os.environ.get("WEATHER_RATE_LIMIT_PER_MINUTE", 60)))
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def get_json(url, params):
+    """
+    GET an OpenWeatherMap endpoint and decode its JSON reply.
+
+    Identical requests already in flight are joined rather than sent again, and
+    outbound calls are bounded by the concurrency and rate limits.
+    """
+    key = (url, tuple(sorted(params.items())))
+    with _in_flight_lock:
+        pending = _in_flight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _in_flight[key] = futures.Future()
+    if not leader:
+        return pending.result()
+
+    try:
+        with _request_slots:
+            rate_limiter.acquire()
+            response = weather_session.get(url, params=params, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+    except BaseException as e:
+        with _in_flight_lock:
+            del _in_flight[key]
+        pending.set_exception(e)
+        raise
+    with _in_flight_lock:
+        del _in_flight[key]
+    pending.set_result(data)
+    return data
+
+class GeocodeCache:
+    """
+    Location name -> coordinates cache shared by the weather tools.
+
+    Coordinates never change, so lookups are kept in a small in-memory LRU in
+    front of a SQLite file that survives restarts (and is shared by gunicorn
+    workers). WEATHER_GEOCODE_DB="", or a file that can't be opened, keeps the
+    cache in memory only.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        if path is None:
+            # not tempfile.gettempdir(), which raises when no temp dir is writable
+            path = os.environ.get("WEATHER_GEOCODE_DB", "/tmp/whereami-geocode.sqlite3")
+        self.path = path
+        self.max_entries = max_entries or int(os.environ.get("WEATHER_GEOCODE_CACHE_SIZE", 1024))
+        self._memory = OrderedDict()
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """The SQLite connection, or None once the file turned out to be unusable"""
+        # opened lazily so each gunicorn worker gets its own connection after fork
+        if self._db is None and self.path:
+            db = None
+            try:
+                db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS geocode ("
+                           "query TEXT PRIMARY KEY, lat REAL, lon REAL, name TEXT, country TEXT)")
+            except sqlite3.Error as e:
+                # e.g. a read-only root filesystem; it won't get better, so
+                # stop trying instead of failing again on every miss
+                logging.warning(f"Geocode cache file {self.path} unusable, keeping geocodes in memory only: {str(e)}")
+                if db is not None:
+                    db.close()
+                self.path = None
+                return None
+            self._db = db
+        return self._db
+
+    def _remember(self, key, place):
+        self._memory[key] = place
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, location):
+        """Return the cached place for a location as a dict with lat, lon, name and country, or None"""
+        key = normalize_prompt(location)
+        with self._lock:
+            place = self._memory.get(key)
+            if place is not None:
+                self._memory.move_to_end(key)
+                return place
+            db = self._connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute(
+                    "SELECT lat, lon, name, country FROM geocode WHERE query = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Geocode cache lookup failed: {str(e)}")
+                return None
+            if row is None:
+                return None
+            place = dict(zip(("lat", "lon", "name", "country"), row))
+            self._remember(key, place)
+            return place
+
+    def put(self, location, place):
+        """Store the place a location resolved to"""
+        key = normalize_prompt(location)
+        with self._lock:
+            self._remember(key, place)
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                               (key, place["lat"], place["lon"], place["name"], place["country"]))
+            except sqlite3.Error as e:
+                logging.warning(f"Geocode cache write failed: {str(e)}")
+
+geocode_cache = GeocodeCache()
+
+# weather changes, but not between the tool calls of one busy minute
+current_weather_cache = ResponseCache(ttl=float(os.environ.get("WEATHER_CURRENT_TTL", 600)),
+                                      max_entries=256, name='weather_current')
+forecast_cache = ResponseCache(ttl=float(os.environ.get("WEATHER_FORECAST_TTL", 1800)),
+                               max_entries=256, name='weather_forecast')
+
+def geocode(location, api_key):
+    """
+    Resolve a location name to coordinates, from cache when possible.
+
+    Returns:
+        dict with lat, lon, name and country, or None if the location isn't found
+    """
+    place = geocode_cache.get(location)
+    if place is not None:
+        return place
+
+    geo_url = f"http://api.openweathermap.org/geo/1.0/direct"
+    geo_params = {
+        "q": location,
+        "limit": 1,
+        "appid": api_key
+    }
+    
+    geo_data = get_json(geo_url, geo_params)
+    
+    if not geo_data:
+        return None
+    
+    place = {
+        "lat": geo_data[0]["lat"],
+        "lon": geo_data[0]["lon"],
+        "name": geo_data[0]["name"],
+        "country": geo_data[0].get("country", "")
+    }
+    geocode_cache.put(location, place)
+    return place
 
 class WeatherTools:
     """Tools for getting weather information for locations"""
@@ -40,22 +246,13 @@ class WeatherTools:
                 })
             
             # Get coordinates first
-            geo_url = f"http://api.openweathermap.org/geo/1.0/direct"
-            geo_params = {
-                "q": location,
-                "limit": 1,
-                "appid": api_key
-            }
+            place = geocode(location, api_key)
             
-            geo_response = requests.get(geo_url, params=geo_params, timeout=10)
-            geo_response.raise_for_status()
-            geo_data = geo_response.json()
-            
-            if not geo_data:
+            if place is None:
                 return json.dumps({"error": f"Location '{location}' not found"})
             
-            lat = geo_data[0]["lat"]
-            lon = geo_data[0]["lon"]
+            lat = place["lat"]
+            lon = place["lon"]
             
             # Get weather data
             weather_url = f"http://api.openweathermap.org/data/2.5/weather"
@@ -66,12 +263,11 @@ class WeatherTools:
                 "units": "metric"
             }
             
-            weather_response = requests.get(weather_url, params=weather_params, timeout=10)
-            weather_response.raise_for_status()
-            weather_data = weather_response.json()
+            weather_data = current_weather_cache.get_or_compute(
+                (lat, lon), lambda: get_json(weather_url, weather_params))
             
             result = {
-                "location": f"{geo_data[0]['name']}, {geo_data[0].get('country', '')}",
+                "location": f"{place['name']}, {place['country']}",
                 "coordinates": {"lat": lat, "lon": lon},
                 "temperature": {
                     "celsius": weather_data["main"]["temp"],
@@ -121,22 +317,13 @@ class WeatherTools:
             days = max(1, min(days, 5))
             
             # Get coordinates first
-            geo_url = f"http://api.openweathermap.org/geo/1.0/direct"
-            geo_params = {
-                "q": location,
-                "limit": 1,
-                "appid": api_key
-            }
-            
-            geo_response = requests.get(geo_url, params=geo_params, timeout=10)
-            geo_response.raise_for_status()
-            geo_data = geo_response.json()
+            place = geocode(location, api_key)
             
-            if not geo_data:
+            if place is None:
                 return json.dumps({"error": f"Location '{location}' not found"})
             
-            lat = geo_data[0]["lat"]
-            lon = geo_data[0]["lon"]
+            lat = place["lat"]
+            lon = place["lon"]
             
             # Get forecast data
             forecast_url = f"http://api.openweathermap.org/data/2.5/forecast"
@@ -148,9 +335,8 @@ class WeatherTools:
                 "cnt": days * 8  # 8 forecasts per day (every 3 hours)
             }
             
-            forecast_response = requests.get(forecast_url, params=forecast_params, timeout=10)
-            forecast_response.raise_for_status()
-            forecast_data = forecast_response.json()
+            forecast_data = forecast_cache.get_or_compute(
+                (lat, lon, days), lambda: get_json(forecast_url, forecast_params))
             
             # Process forecast data by day
             daily_forecasts = {}
@@ -179,7 +365,7 @@ class WeatherTools:
                 })
             
             result = {
-                "location": f"{geo_data[0]['name']}, {geo_data[0].get('country', '')}",
+                "location": f"{place['name']}, {place['country']}",
                 "forecast_days": days,
                 "forecast": forecast_summary
             }
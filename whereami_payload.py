@@ -1,7 +1,14 @@
+import asyncio
+import functools
+import hashlib
 import sys
 import socket
 import os
+import threading
+import time
+from concurrent import futures
 from datetime import datetime
+from types import MappingProxyType
 import emoji
 import logging
 from logging.config import dictConfig
@@ -9,26 +16,33 @@ import requests
 from requests.adapters import HTTPAdapter
 import urllib3
 from urllib3 import Retry
-# gRPC stuff
-import grpc
 from six import b
-import whereami_pb2
-import whereami_pb2_grpc
+from google.protobuf import json_format
+import backend_clients
+import fast_json
+from log_utils import log_once
 
-METADATA_URL = 'http://metadata.google.internal/computeMetadata/v1/'
+# GCE_METADATA_HOST is the same override google-auth honours, e.g. for a local stand-in
+METADATA_URL = 'http://%s/computeMetadata/v1/' % os.getenv('GCE_METADATA_HOST', 'metadata.google.internal')
 METADATA_HEADERS = {'Metadata-Flavor': 'Google'}
 GRPC_SECURE_PORTS = ['443', '8443'] # when using gRPC, this list is checked when determining to use a secure or insecure channel
 
 # set up logging
 dictConfig({
     'version': 1,
+    'disable_existing_loggers': False,
     'formatters': {'default': {
         'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
     }},
+    'filters': {'rate_limit': {
+        '()': 'log_utils.RateLimitFilter'
+    }},
     'handlers': {'wsgi': {
-        'class': 'logging.StreamHandler',
+        # records are formatted and written on a background thread
+        'class': 'log_utils.QueueStreamHandler',
         'stream': 'ext://sys.stdout',
-        'formatter': 'default'
+        'formatter': 'default',
+        'filters': ['rate_limit']
     }},
     'root': {
         'level': 'INFO',
@@ -44,211 +58,554 @@ class WhereamiPayload(object):
 
     def __init__(self):
 
-        self.payload = {}
         self.gce_metadata = {} # this will cache the results from calling GCE metadata
 
+        # per-request behaviour is driven by env vars that don't change for the
+        # life of the process, so read them once here
+        self.backend_enabled = os.getenv('BACKEND_ENABLED') == 'True'
+        self.backend_service = os.getenv('BACKEND_SERVICE')
+        self.grpc_enabled = os.getenv('GRPC_ENABLED') == 'True'
+        self.echo_headers = os.getenv('ECHO_HEADERS') == 'True'
+        self.backend_deadline = float(os.getenv('BACKEND_DEADLINE', 10.0))
+        self.metadata_timeout = float(os.getenv('METADATA_TIMEOUT', 2.0))
+        self.metadata_retries = int(os.getenv('METADATA_RETRIES', 3))
+        self.metadata_watch = os.getenv('METADATA_WATCH', 'True') == 'True'
+        self.metadata_watch_timeout = int(os.getenv('METADATA_WATCH_TIMEOUT', 300))
+        self.metadata_etag = None
+        self._stop_watching = threading.Event()
+
+        # everything that doesn't vary per request is computed once and frozen;
+        # build_payload() copies it and overlays the per-request fields. It stays
+        # empty until GCE metadata has been fetched in the background, so the
+        # servers can bind straight away and report not ready in the meantime
+        self.snapshot = MappingProxyType({})
+        self.ready = threading.Event()
+        self._start_metadata_fetch()
+
+        # gunicorn imports the app before forking workers, and threads don't
+        # survive a fork, so a worker forked mid-fetch starts its own
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._restart_metadata_fetch)
+
+    @property
+    def snapshot(self):
+        return self._snapshot[0]
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        # the snapshot's JSON and per-field ETags are computed once, here, and
+        # swapped in with it so readers never pair a snapshot with stale ones
+        etags = {name: hashlib.sha1(fast_json.dumps(value)).hexdigest()
+                 for name, value in snapshot.items()}
+        self._snapshot = (snapshot, fast_json.encode_prefix(snapshot), MappingProxyType(etags))
+
+    def field_etag(self, name):
+        """
+        Strong ETag for a snapshot field, derived from its value, or None for
+        fields that vary per request (timestamp, backend results, ...)
+        """
+        return self._snapshot[2].get(name)
+
+    def static_fields(self, names):
+        """
+        Values and ETags of snapshot fields, read from a single snapshot so
+        they always agree even if a metadata change swaps it meanwhile.
+
+        Returns:
+            tuple: ({name: value}, [etag, ...]) in the order of names, or None
+                   if any of them isn't a snapshot field
+        """
+        snapshot, _, etags = self._snapshot
+        if not all(name in etags for name in names):
+            return None
+        return {name: snapshot[name] for name in names}, [etags[name] for name in names]
+
+    def _start_metadata_fetch(self):
+        threading.Thread(target=self._load_metadata, name='gce-metadata', daemon=True).start()
+
+    def _restart_metadata_fetch(self):
+        if not self.ready.is_set():
+            self.ready = threading.Event()
+            self._start_metadata_fetch()
+        elif self.metadata_watch and self.metadata_etag:
+            threading.Thread(target=self._watch_metadata, name='gce-metadata', daemon=True).start()
+
+    def _load_metadata(self):
+
         # configure retries for GCE metadata GET
         # we're doing this because, on GKE, metadata endpoint can take a few seconds to be available
         # see https://cloud.google.com/kubernetes-engine/docs/how-to/workload-identity#limitations
+        # retries and timeouts are bounded so that, off GCP, we give up within seconds
 
         # everything else
         session = requests.Session()
-        adapter = HTTPAdapter(max_retries=Retry(connect=3, read=3, other=3, total=3, backoff_factor=5)) #, status_forcelist=[429, 500, 502, 503, 504]))
+        retries = self.metadata_retries
+        adapter = HTTPAdapter(max_retries=Retry(connect=retries, read=retries, other=retries, total=retries, backoff_factor=1)) #, status_forcelist=[429, 500, 502, 503, 504]))
         session.mount("http://", adapter)
         session.mount("https://", adapter)
 
         try:
             # grab info from GCE metadata
             r = session.get(METADATA_URL + '?recursive=true',
-                                headers=METADATA_HEADERS)
+                                headers=METADATA_HEADERS, timeout=self.metadata_timeout)
             if r.ok:
                 logging.info("Successfully accessed GCE metadata endpoint.")
                 self.gce_metadata = r.json()
+                self.metadata_etag = r.headers.get('ETag')
         except:
             logging.warning("Unable to access GCE metadata endpoint.")
 
+        self.snapshot = self._build_snapshot()
+        self.ready.set()
+        logging.info("Payload snapshot ready.")
 
-    def build_payload(self, request_headers):
-
-        # header propagation for HTTP calls to downward services
-        # for Istio / Anthos Service Mesh
-        def getForwardHeaders(request_headers):
-            headers = {}
-            incoming_headers = ['x-request-id',
-                                'x-b3-traceid',
-                                'x-b3-spanid',
-                                'x-b3-parentspanid',
-                                'x-b3-sampled',
-                                'x-b3-flags',
-                                'x-ot-span-context',
-                                'x-cloud-trace-context',
-                                'traceparent',
-                                'grpc-trace-bin'
-                                ]
-
-            for ihdr in incoming_headers:
-                val = request_headers.get(ihdr)
-                if val is not None:
-                    headers[ihdr] = val
-
-            return headers
-
-        # call HTTP backend (expect JSON reesponse)
-        def call_http_backend(backend_service):
-
-            try:
-                r = requests.get(backend_service,
-                                 headers=getForwardHeaders(request_headers))
-                if r.ok:
-                    backend_result = r.json()
-                else:
-                    backend_result = None
-            except:
-
-                logging.warning(sys.exc_info()[0])
-                backend_result = None
+        if self.metadata_watch and self.metadata_etag:
+            self._watch_metadata()
 
-            return backend_result
-
-        # call gRPC backend
-        def call_grpc_backend(backend_service):
+    def _watch_metadata(self):
+        """
+        Keep the snapshot in step with GCE metadata (e.g. cluster-name or custom
+        attributes changing) using the metadata server's wait_for_change long poll.
 
+        Each request blocks on the server until the metadata's ETag moves on or
+        METADATA_WATCH_TIMEOUT passes. On a change a new snapshot is built and
+        swapped in with a single assignment, so requests never see a half-built one.
+        """
+        session = requests.Session()
+        backoff = 1
+        while not self._stop_watching.is_set():
             try:
-                # assumes port number is appended to backend_service name
-                if backend_service.split(':')[1] in GRPC_SECURE_PORTS:
-                    logging.info("Using gRPC secure channel.")
-                    channel = grpc.secure_channel(backend_service, grpc.ssl_channel_credentials())
-                else:
-                    logging.info("Using gRPC insecure channel.")
-                    channel = grpc.insecure_channel(backend_service)
-                
-                stub = whereami_pb2_grpc.WhereamiStub(channel)
-                backend_result = stub.GetPayload(
-                    whereami_pb2.Empty())
-
-            except:
-                backend_result = None
-                logging.warning("Unable to capture backend result.")
-
-            return backend_result
+                r = session.get(METADATA_URL,
+                                params={'recursive': 'true',
+                                        'wait_for_change': 'true',
+                                        'last_etag': self.metadata_etag,
+                                        'timeout_sec': self.metadata_watch_timeout},
+                                headers=METADATA_HEADERS,
+                                timeout=(self.metadata_timeout, self.metadata_watch_timeout + 10))
+                r.raise_for_status()
+            except Exception as e:
+                logging.warning("Watching GCE metadata failed, retrying in %ss: %s", backoff, e)
+                self._stop_watching.wait(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+
+            etag = r.headers.get('ETag')
+            if etag == self.metadata_etag:
+                continue
+            self.gce_metadata = r.json()
+            self.metadata_etag = etag
+            self.snapshot = self._build_snapshot()
+            logging.info("GCE metadata changed, payload snapshot refreshed.")
+
+    def stop_watching(self):
+        """Stop the GCE metadata watcher after its current long poll returns"""
+        self._stop_watching.set()
+
+    def is_ready(self):
+        """True once GCE metadata has been fetched (or given up on) and the snapshot is built"""
+        return self.ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """Block until the snapshot is built, or timeout seconds pass; returns is_ready()"""
+        return self.ready.wait(timeout)
+
+
+    def _build_snapshot(self):
+
+        snapshot = {}
 
         # grab info from cached GCE metadata
         if len(self.gce_metadata):
-            logging.info("Found cached GCE metadata.")
+            log_once(logging.INFO, "Found cached GCE metadata.")
 
             # get project
-            self.payload['project_id'] = self.gce_metadata['project']['projectId']
+            snapshot['project_id'] = self.gce_metadata['project']['projectId']
 
             # if we're running in Cloud Run, we can retrieve the region
             # else, we can get the zone
             try:
-                self.payload['region'] = self.gce_metadata['instance']['region'].split('/')[-1]
+                snapshot['region'] = self.gce_metadata['instance']['region'].split('/')[-1]
             except:
-                logging.warning("Unable to capture GCP region.")
-            
+                log_once(logging.WARNING, "Unable to capture GCP region.")
+
             try:
-                self.payload['zone'] = self.gce_metadata['instance']['zone'].split('/')[-1]
+                snapshot['zone'] = self.gce_metadata['instance']['zone'].split('/')[-1]
             except:
-                logging.warning("Unable to capure GCP zone.")
+                log_once(logging.WARNING, "Unable to capure GCP zone.")
 
             # if we're running in GKE, we can also get cluster name
             try:
-                self.payload['cluster_name'] = self.gce_metadata['instance']['attributes']['cluster-name']
+                snapshot['cluster_name'] = self.gce_metadata['instance']['attributes']['cluster-name']
             except:
-                logging.warning("Unable to capture GKE cluster name.")
+                log_once(logging.WARNING, "Unable to capture GKE cluster name.")
             # if we're running on Google, grab the instance ID and default Google service account
             try:
-                self.payload['gce_instance_id'] = str(self.gce_metadata['instance']['id']) # casting to str as value can be alphanumeric on Cloud Run
+                snapshot['gce_instance_id'] = str(self.gce_metadata['instance']['id']) # casting to str as value can be alphanumeric on Cloud Run
             except:
-                logging.warning("Unable to capture GCE instance ID.")
+                log_once(logging.WARNING, "Unable to capture GCE instance ID.")
             try:
-                self.payload['gce_service_account'] = self.gce_metadata['instance']['serviceAccounts']['default']['email']
+                snapshot['gce_service_account'] = self.gce_metadata['instance']['serviceAccounts']['default']['email']
             except:
-                logging.warning("Unable to capture GCE service account.")
+                log_once(logging.WARNING, "Unable to capture GCE service account.")
         else:
-            logging.warning("GCE metadata unavailable.")
+            log_once(logging.WARNING, "GCE metadata unavailable.")
 
         # get node name via downward API
         if os.getenv('NODE_NAME'):
-            self.payload['node_name'] = os.getenv('NODE_NAME')
+            snapshot['node_name'] = os.getenv('NODE_NAME')
         else:
-            logging.warning("Unable to capture node name.")
-
-        # get host header
-        try:
-            self.payload['host_header'] = request_headers.get('host')
-        except:
-            logging.warning("Unable to capture host header.")
+            log_once(logging.WARNING, "Unable to capture node name.")
 
-        # get pod name, emoji & datetime
-        self.payload['pod_name'] = socket.gethostname()
-        self.payload['pod_name_emoji'] = emoji_list[hash(
-            socket.gethostname()) % len(emoji_list)]
-        self.payload['timestamp'] = datetime.now().replace(
-            microsecond=0).isoformat()
+        # get pod name & emoji
+        pod_name = socket.gethostname()
+        snapshot['pod_name'] = pod_name
+        snapshot['pod_name_emoji'] = emoji_list[hash(pod_name) % len(emoji_list)]
 
         # get namespace, pod ip, and pod service account via downward API
         if os.getenv('POD_NAMESPACE'):
-            self.payload['pod_namespace'] = os.getenv('POD_NAMESPACE')
+            snapshot['pod_namespace'] = os.getenv('POD_NAMESPACE')
         else:
-            logging.warning("Unable to capture pod namespace.")
+            log_once(logging.WARNING, "Unable to capture pod namespace.")
 
         if os.getenv('POD_IP'):
-            self.payload['pod_ip'] = os.getenv('POD_IP')
+            snapshot['pod_ip'] = os.getenv('POD_IP')
         else:
-            logging.warning("Unable to capture pod IP address.")
+            log_once(logging.WARNING, "Unable to capture pod IP address.")
 
         if os.getenv('POD_SERVICE_ACCOUNT'):
-            self.payload['pod_service_account'] = os.getenv(
+            snapshot['pod_service_account'] = os.getenv(
                 'POD_SERVICE_ACCOUNT')
         else:
-            logging.warning("Unable to capture pod KSA.")
+            log_once(logging.WARNING, "Unable to capture pod KSA.")
 
         # get Cloud Run service name and revision if available
         if os.getenv('K_SERVICE'):
-            self.payload['service_name'] = os.getenv('K_SERVICE')
+            snapshot['service_name'] = os.getenv('K_SERVICE')
         else:
-            logging.warning("Unable to capture Cloud Run service name.")
+            log_once(logging.WARNING, "Unable to capture Cloud Run service name.")
 
         if os.getenv('K_REVISION'):
-            self.payload['service_revision'] = os.getenv('K_REVISION')
+            snapshot['service_revision'] = os.getenv('K_REVISION')
         else:
-            logging.warning("Unable to get Cloud Run revision being run.")
+            log_once(logging.WARNING, "Unable to get Cloud Run revision being run.")
 
         # get the whereami METADATA envvar
         if os.getenv('METADATA'):
-            self.payload['metadata'] = os.getenv('METADATA')
+            snapshot['metadata'] = os.getenv('METADATA')
         else:
-            logging.warning("Unable to capture metadata environment variable.")
+            log_once(logging.WARNING, "Unable to capture metadata environment variable.")
+
+        return MappingProxyType(snapshot)
+
+
+    def parse_backends(self):
+        """
+        Split BACKEND_SERVICE into (protocol, target) pairs.
+
+        BACKEND_SERVICE may list several backends separated by commas. Targets
+        with an http:// or https:// scheme are called over HTTP, targets with a
+        grpc:// prefix over gRPC, and bare host:port targets follow GRPC_ENABLED.
+        """
+        backends = []
+        for target in (self.backend_service or '').split(','):
+            target = target.strip()
+            if not target:
+                continue
+            if target.startswith(('http://', 'https://')):
+                backends.append(('http', target))
+            elif target.startswith('grpc://'):
+                backends.append(('grpc', target[len('grpc://'):]))
+            elif self.grpc_enabled:
+                backends.append(('grpc', target))
+            else:
+                backends.append(('http', target))
+        return backends
 
-        # should we call a backend service?
-        if os.getenv('BACKEND_ENABLED') == 'True':
 
-            backend_service = os.getenv('BACKEND_SERVICE')
-            logging.info("Attempting to call %s", backend_service)
+    # header propagation for HTTP calls to downward services
+    # for Istio / Anthos Service Mesh
+    @staticmethod
+    def getForwardHeaders(request_headers):
+        headers = {}
+        if request_headers is None:
+            return headers
 
-            if os.getenv('GRPC_ENABLED') == "True":
+        incoming_headers = ['x-request-id',
+                            'x-b3-traceid',
+                            'x-b3-spanid',
+                            'x-b3-parentspanid',
+                            'x-b3-sampled',
+                            'x-b3-flags',
+                            'x-ot-span-context',
+                            'x-cloud-trace-context',
+                            'traceparent',
+                            'grpc-trace-bin'
+                            ]
+
+        for ihdr in incoming_headers:
+            val = request_headers.get(ihdr)
+            if val is not None:
+                headers[ihdr] = val
+
+        return headers
+
+
+    @staticmethod
+    def _backend_entry(protocol, backend_service, latency, error=None, result=None):
+        return {
+            'backend': backend_service,
+            'protocol': protocol,
+            'latency_ms': round(latency * 1000, 3),
+            'error': error,
+            'result': result
+        }
+
+
+    def call_backend(self, protocol, backend_service, forward_headers):
+        """
+        Call one backend and time it.
+
+        Returns:
+            dict: backend, protocol, latency_ms, error and result (the backend's
+            payload as a dict, or None if the call failed)
+        """
+        started = time.monotonic()
+        error = None
+        try:
+            if protocol == 'grpc':
+                # assumes port number is appended to backend_service name
+                secure = backend_service.split(':')[1] in GRPC_SECURE_PORTS
+                reply = backend_clients.get_grpc_channels().get_payload(
+                    backend_service, secure)
+                # keep payloads protocol neutral; the gRPC servicer converts back
+                result = json_format.MessageToDict(reply, preserving_proto_field_name=True)
+            else:
+                # call HTTP backend (expect JSON reesponse)
+                result = backend_clients.get_http_client().get_json(
+                    backend_service, headers=forward_headers)
+                if result is None:
+                    error = "backend returned an error status"
+        except Exception as e:
+            logging.warning("Unable to capture backend result from %s: %s", backend_service, e)
+            result = None
+            error = str(e) or type(e).__name__
+
+        return self._backend_entry(protocol, backend_service,
+                                   time.monotonic() - started, error, result)
+
+
+    async def call_backend_async(self, protocol, backend_service, forward_headers):
+        """
+        asyncio flavour of call_backend() for the grpc.aio server.
+
+        gRPC backends are awaited on grpc.aio channels. HTTP backends still use
+        the pooled requests client, run on the fan-out thread pool so they don't
+        block the event loop.
+        """
+        started = time.monotonic()
+        error = None
+        try:
+            if protocol == 'grpc':
+                secure = backend_service.split(':')[1] in GRPC_SECURE_PORTS
+                reply = await backend_clients.get_aio_grpc_channels().get_payload(
+                    backend_service, secure)
+                result = json_format.MessageToDict(reply, preserving_proto_field_name=True)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    backend_clients.get_fanout_executor(),
+                    functools.partial(backend_clients.get_http_client().get_json,
+                                      backend_service, headers=forward_headers))
+                if result is None:
+                    error = "backend returned an error status"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("Unable to capture backend result from %s: %s", backend_service, e)
+            result = None
+            error = str(e) or type(e).__name__
+
+        return self._backend_entry(protocol, backend_service,
+                                   time.monotonic() - started, error, result)
+
+
+    def call_backends(self, request_headers):
+        """
+        Call every configured backend concurrently under one overall deadline.
+
+        A slow backend doesn't hold up the others: results are collected until
+        BACKEND_DEADLINE expires and anything still running is reported as timed
+        out.
+
+        Returns:
+            list: one call_backend() result per backend, in BACKEND_SERVICE order
+        """
+        backends = self.parse_backends()
+        forward_headers = self.getForwardHeaders(request_headers)
+
+        if len(backends) == 1:
+            protocol, target = backends[0]
+            return [self.call_backend(protocol, target, forward_headers)]
+
+        executor = backend_clients.get_fanout_executor()
+        calls = [executor.submit(self.call_backend, protocol, target, forward_headers)
+                 for protocol, target in backends]
+        futures.wait(calls, timeout=self.backend_deadline)
+
+        results = []
+        for (protocol, target), call in zip(backends, calls):
+            if call.done():
+                results.append(call.result())
+            else:
+                call.cancel()
+                logging.warning("Backend %s did not reply within %ss.", target, self.backend_deadline)
+                results.append(self._backend_entry(protocol, target, self.backend_deadline,
+                                                   "deadline exceeded"))
+        return results
+
+
+    async def call_backends_async(self, request_headers):
+        """asyncio flavour of call_backends(), with the same deadline semantics"""
+        backends = self.parse_backends()
+        forward_headers = self.getForwardHeaders(request_headers)
+
+        calls = [asyncio.ensure_future(self.call_backend_async(protocol, target, forward_headers))
+                 for protocol, target in backends]
+        await asyncio.wait(calls, timeout=self.backend_deadline)
+
+        results = []
+        for (protocol, target), call in zip(backends, calls):
+            if call.done():
+                results.append(call.result())
+            else:
+                call.cancel()
+                logging.warning("Backend %s did not reply within %ss.", target, self.backend_deadline)
+                results.append(self._backend_entry(protocol, target, self.backend_deadline,
+                                                   "deadline exceeded"))
+        return results
 
-                backend_result = call_grpc_backend(backend_service)
 
-                if backend_result:
+    def _request_fields(self, request_headers, fields=None):
 
-                    self.payload['backend_result'] = backend_result
+        result = {}
 
-            else:
+        # get host header
+        if fields is None or 'host_header' in fields:
+            try:
+                result['host_header'] = request_headers.get('host')
+            except:
+                logging.warning("Unable to capture host header.")
+
+        # get datetime
+        if fields is None or 'timestamp' in fields:
+            result['timestamp'] = datetime.now().replace(
+                microsecond=0).isoformat()
 
-                self.payload['backend_result'] = call_http_backend(backend_service)
+        return result
 
-        echo_headers = os.getenv('ECHO_HEADERS')
 
-        if echo_headers == 'True':
+    @staticmethod
+    def _add_backend_results(payload, results):
+
+        if len(results) == 1:
+            # a single backend keeps the original payload shape
+            if results[0]['result'] is not None or results[0]['protocol'] == 'http':
+                payload['backend_result'] = results[0]['result']
+        else:
+            payload['backend_result'] = results
+
+
+    def _add_echo_headers(self, payload, request_headers):
+
+        if self.echo_headers:
 
             try:
 
-                self.payload['headers'] = {k: v for k, v in request_headers.items()}
+                payload['headers'] = {k: v for k, v in request_headers.items()}
 
             except:
 
                 logging.warning("Unable to capture inbound headers.")
 
-        return self.payload
+
+    def _snapshot_fields(self, fields=None):
+
+        if fields is None:
+            return dict(self.snapshot)
+        snapshot = self.snapshot
+        return {name: snapshot[name] for name in fields if name in snapshot}
+
+
+    def _wants_backends(self, fields=None):
+
+        return self.backend_enabled and (fields is None or 'backend_result' in fields)
+
+
+    def _build_fields(self, request_headers, fields=None):
+
+        result = self._request_fields(request_headers, fields)
+
+        # should we call a backend service? only if the caller wants its answer
+        if self._wants_backends(fields):
+
+            logging.debug("Attempting to call %s", self.backend_service)
+            self._add_backend_results(result, self.call_backends(request_headers))
+
+        if fields is None or 'headers' in fields:
+            self._add_echo_headers(result, request_headers)
+
+        return result
+
+
+    def build_payload(self, request_headers, fields=None):
+        """
+        Build the payload for a request.
+
+        Args:
+            request_headers: Inbound request headers, or None over gRPC
+            fields: Optional collection of payload keys to return. Only those
+                are computed, so backends are only called for 'backend_result'
+
+        Returns:
+            dict: A new dict, safe for the caller to modify
+        """
+
+        # each request gets its own dict layered over the shared snapshot, so
+        # concurrent requests never see each other's headers or backend results
+        payload = self._snapshot_fields(fields)
+        payload.update(self._build_fields(request_headers, fields))
+
+        return payload
+
+
+    def build_payload_json(self, request_headers, fields=None):
+        """
+        build_payload() encoded as compact JSON bytes.
+
+        For the whole payload only the per-request fields are encoded here;
+        they're spliced onto the snapshot's JSON, which is encoded once when the
+        snapshot is built.
+        """
+        if fields is not None:
+            return fast_json.dumps(self.build_payload(request_headers, fields))
+        _, encoded_snapshot, _ = self._snapshot
+        return fast_json.splice(encoded_snapshot, self._build_fields(request_headers))
+
+
+    async def build_payload_async(self, request_headers, fields=None):
+
+        result = self._request_fields(request_headers, fields)
+
+        if self._wants_backends(fields):
+
+            logging.debug("Attempting to call %s", self.backend_service)
+            self._add_backend_results(result, await self.call_backends_async(request_headers))
+
+        if fields is None or 'headers' in fields:
+            self._add_echo_headers(result, request_headers)
+
+        payload = self._snapshot_fields(fields)
+        payload.update(result)
+
+        return payload
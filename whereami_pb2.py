@@ -11,19 +11,27 @@ from google.protobuf import symbol_database as _symbol_database
 _sym_db = _symbol_database.Default()
 
 
+from google.protobuf import field_mask_pb2 as google_dot_protobuf_dot_field__mask__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0ewhereami.proto\x12\x08whereami\"\x07\n\x05\x45mpty\"\xd4\x02\n\rWhereamiReply\x12/\n\x0e\x62\x61\x63kend_result\x18\x01 \x01(\x0b\x32\x17.whereami.WhereamiReply\x12\x14\n\x0c\x63luster_name\x18\x02 \x01(\t\x12\x10\n\x08metadata\x18\x03 \x01(\t\x12\x11\n\tnode_name\x18\x04 \x01(\t\x12\x0e\n\x06pod_ip\x18\x05 \x01(\t\x12\x10\n\x08pod_name\x18\x06 \x01(\t\x12\x16\n\x0epod_name_emoji\x18\x07 \x01(\t\x12\x15\n\rpod_namespace\x18\x08 \x01(\t\x12\x1b\n\x13pod_service_account\x18\t \x01(\t\x12\x12\n\nproject_id\x18\n \x01(\t\x12\x11\n\ttimestamp\x18\x0b \x01(\t\x12\x0c\n\x04zone\x18\x0c \x01(\t\x12\x17\n\x0fgce_instance_id\x18\r \x01(\t\x12\x1b\n\x13gce_service_account\x18\x0e \x01(\t2D\n\x08Whereami\x12\x38\n\nGetPayload\x12\x0f.whereami.Empty\x1a\x17.whereami.WhereamiReply\"\x00\x62\x06proto3')
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0ewhereami.proto\x12\x08whereami\x1a google/protobuf/field_mask.proto\"\x07\n\x05\x45mpty\"@\n\x0ePayloadRequest\x12.\n\nfield_mask\x18\x01 \x01(\x0b\x32\x1a.google.protobuf.FieldMask\"n\n\x0cWatchRequest\x12\x18\n\x10interval_seconds\x18\x01 \x01(\x01\x12\x14\n\x0c\x63hanges_only\x18\x02 \x01(\x08\x12.\n\nfield_mask\x18\x03 \x01(\x0b\x32\x1a.google.protobuf.FieldMask\"\x86\x03\n\rWhereamiReply\x12/\n\x0e\x62\x61\x63kend_result\x18\x01 \x01(\x0b\x32\x17.whereami.WhereamiReply\x12\x14\n\x0c\x63luster_name\x18\x02 \x01(\t\x12\x10\n\x08metadata\x18\x03 \x01(\t\x12\x11\n\tnode_name\x18\x04 \x01(\t\x12\x0e\n\x06pod_ip\x18\x05 \x01(\t\x12\x10\n\x08pod_name\x18\x06 \x01(\t\x12\x16\n\x0epod_name_emoji\x18\x07 \x01(\t\x12\x15\n\rpod_namespace\x18\x08 \x01(\t\x12\x1b\n\x13pod_service_account\x18\t \x01(\t\x12\x12\n\nproject_id\x18\n \x01(\t\x12\x11\n\ttimestamp\x18\x0b \x01(\t\x12\x0c\n\x04zone\x18\x0c \x01(\t\x12\x17\n\x0fgce_instance_id\x18\r \x01(\t\x12\x1b\n\x13gce_service_account\x18\x0e \x01(\t\x12\x30\n\x0f\x62\x61\x63kend_results\x18\x0f \x03(\x0b\x32\x17.whereami.BackendResult\"~\n\rBackendResult\x12\x0f\n\x07\x62\x61\x63kend\x18\x01 \x01(\t\x12\x10\n\x08protocol\x18\x02 \x01(\t\x12\x12\n\nlatency_ms\x18\x03 \x01(\x01\x12\r\n\x05\x65rror\x18\x04 \x01(\t\x12\'\n\x06result\x18\x05 \x01(\x0b\x32\x17.whereami.WhereamiReply2\x92\x01\n\x08Whereami\x12\x41\n\nGetPayload\x12\x18.whereami.PayloadRequest\x1a\x17.whereami.WhereamiReply\"\x00\x12\x43\n\x0cWatchPayload\x12\x16.whereami.WatchRequest\x1a\x17.whereami.WhereamiReply\"\x00\x30\x01\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'whereami_pb2', globals())
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _EMPTY._serialized_start=28
-  _EMPTY._serialized_end=35
-  _WHEREAMIREPLY._serialized_start=38
-  _WHEREAMIREPLY._serialized_end=378
-  _WHEREAMI._serialized_start=380
-  _WHEREAMI._serialized_end=448
+  _EMPTY._serialized_start=62
+  _EMPTY._serialized_end=69
+  _PAYLOADREQUEST._serialized_start=71
+  _PAYLOADREQUEST._serialized_end=135
+  _WATCHREQUEST._serialized_start=137
+  _WATCHREQUEST._serialized_end=247
+  _WHEREAMIREPLY._serialized_start=250
+  _WHEREAMIREPLY._serialized_end=640
+  _BACKENDRESULT._serialized_start=642
+  _BACKENDRESULT._serialized_end=768
+  _WHEREAMI._serialized_start=771
+  _WHEREAMI._serialized_end=917
 # @@protoc_insertion_point(module_scope)
@@ -1,6 +1,8 @@
+from google.protobuf import field_mask_pb2 as _field_mask_pb2
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Mapping as _Mapping, Optional as _Optional, Union as _Union
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -8,8 +10,25 @@ class Empty(_message.Message):
     __slots__ = []
     def __init__(self) -> None: ...
 
+class PayloadRequest(_message.Message):
+    __slots__ = ["field_mask"]
+    FIELD_MASK_FIELD_NUMBER: _ClassVar[int]
+    field_mask: _field_mask_pb2.FieldMask
+    def __init__(self, field_mask: _Optional[_Union[_field_mask_pb2.FieldMask, _Mapping]] = ...) -> None: ...
+
+class WatchRequest(_message.Message):
+    __slots__ = ["changes_only", "field_mask", "interval_seconds"]
+    CHANGES_ONLY_FIELD_NUMBER: _ClassVar[int]
+    FIELD_MASK_FIELD_NUMBER: _ClassVar[int]
+    INTERVAL_SECONDS_FIELD_NUMBER: _ClassVar[int]
+    changes_only: bool
+    field_mask: _field_mask_pb2.FieldMask
+    interval_seconds: float
+    def __init__(self, interval_seconds: _Optional[float] = ..., changes_only: _Optional[bool] = ..., field_mask: _Optional[_Union[_field_mask_pb2.FieldMask, _Mapping]] = ...) -> None: ...
+
 class WhereamiReply(_message.Message):
-    __slots__ = ["backend_result", "cluster_name", "gce_instance_id", "gce_service_account", "metadata", "node_name", "pod_ip", "pod_name", "pod_name_emoji", "pod_namespace", "pod_service_account", "project_id", "timestamp", "zone"]
+    __slots__ = ["backend_result", "backend_results", "cluster_name", "gce_instance_id", "gce_service_account", "metadata", "node_name", "pod_ip", "pod_name", "pod_name_emoji", "pod_namespace", "pod_service_account", "project_id", "timestamp", "zone"]
+    BACKEND_RESULTS_FIELD_NUMBER: _ClassVar[int]
     BACKEND_RESULT_FIELD_NUMBER: _ClassVar[int]
     CLUSTER_NAME_FIELD_NUMBER: _ClassVar[int]
     GCE_INSTANCE_ID_FIELD_NUMBER: _ClassVar[int]
@@ -25,6 +44,7 @@ class WhereamiReply(_message.Message):
     TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
     ZONE_FIELD_NUMBER: _ClassVar[int]
     backend_result: WhereamiReply
+    backend_results: _containers.RepeatedCompositeFieldContainer[BackendResult]
     cluster_name: str
     gce_instance_id: str
     gce_service_account: str
@@ -38,4 +58,18 @@ class WhereamiReply(_message.Message):
     project_id: str
     timestamp: str
     zone: str
-    def __init__(self, backend_result: _Optional[_Union[WhereamiReply, _Mapping]] = ..., cluster_name: _Optional[str] = ..., metadata: _Optional[str] = ..., node_name: _Optional[str] = ..., pod_ip: _Optional[str] = ..., pod_name: _Optional[str] = ..., pod_name_emoji: _Optional[str] = ..., pod_namespace: _Optional[str] = ..., pod_service_account: _Optional[str] = ..., project_id: _Optional[str] = ..., timestamp: _Optional[str] = ..., zone: _Optional[str] = ..., gce_instance_id: _Optional[str] = ..., gce_service_account: _Optional[str] = ...) -> None: ...
+    def __init__(self, backend_result: _Optional[_Union[WhereamiReply, _Mapping]] = ..., cluster_name: _Optional[str] = ..., metadata: _Optional[str] = ..., node_name: _Optional[str] = ..., pod_ip: _Optional[str] = ..., pod_name: _Optional[str] = ..., pod_name_emoji: _Optional[str] = ..., pod_namespace: _Optional[str] = ..., pod_service_account: _Optional[str] = ..., project_id: _Optional[str] = ..., timestamp: _Optional[str] = ..., zone: _Optional[str] = ..., gce_instance_id: _Optional[str] = ..., gce_service_account: _Optional[str] = ..., backend_results: _Optional[_Iterable[_Union[BackendResult, _Mapping]]] = ...) -> None: ...
+
+class BackendResult(_message.Message):
+    __slots__ = ["backend", "error", "latency_ms", "protocol", "result"]
+    BACKEND_FIELD_NUMBER: _ClassVar[int]
+    ERROR_FIELD_NUMBER: _ClassVar[int]
+    LATENCY_MS_FIELD_NUMBER: _ClassVar[int]
+    PROTOCOL_FIELD_NUMBER: _ClassVar[int]
+    RESULT_FIELD_NUMBER: _ClassVar[int]
+    backend: str
+    error: str
+    latency_ms: float
+    protocol: str
+    result: WhereamiReply
+    def __init__(self, backend: _Optional[str] = ..., protocol: _Optional[str] = ..., latency_ms: _Optional[float] = ..., error: _Optional[str] = ..., result: _Optional[_Union[WhereamiReply, _Mapping]] = ...) -> None: ...
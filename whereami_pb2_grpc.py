@@ -19,7 +19,12 @@ class WhereamiStub(object):
         """
         self.GetPayload = channel.unary_unary(
                 '/whereami.Whereami/GetPayload',
-                request_serializer=whereami__pb2.Empty.SerializeToString,
+                request_serializer=whereami__pb2.PayloadRequest.SerializeToString,
+                response_deserializer=whereami__pb2.WhereamiReply.FromString,
+                )
+        self.WatchPayload = channel.unary_stream(
+                '/whereami.Whereami/WatchPayload',
+                request_serializer=whereami__pb2.WatchRequest.SerializeToString,
                 response_deserializer=whereami__pb2.WhereamiReply.FromString,
                 )
 
@@ -37,12 +42,24 @@ class WhereamiServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def WatchPayload(self, request, context):
+        """Stream the payload over one long-lived call at a client-requested interval
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_WhereamiServicer_to_server(servicer, server):
     rpc_method_handlers = {
             'GetPayload': grpc.unary_unary_rpc_method_handler(
                     servicer.GetPayload,
-                    request_deserializer=whereami__pb2.Empty.FromString,
+                    request_deserializer=whereami__pb2.PayloadRequest.FromString,
+                    response_serializer=whereami__pb2.WhereamiReply.SerializeToString,
+            ),
+            'WatchPayload': grpc.unary_stream_rpc_method_handler(
+                    servicer.WatchPayload,
+                    request_deserializer=whereami__pb2.WatchRequest.FromString,
                     response_serializer=whereami__pb2.WhereamiReply.SerializeToString,
             ),
     }
@@ -70,7 +87,24 @@ class Whereami(object):
             timeout=None,
             metadata=None):
         return grpc.experimental.unary_unary(request, target, '/whereami.Whereami/GetPayload',
-            whereami__pb2.Empty.SerializeToString,
+            whereami__pb2.PayloadRequest.SerializeToString,
+            whereami__pb2.WhereamiReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def WatchPayload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/whereami.Whereami/WatchPayload',
+            whereami__pb2.WatchRequest.SerializeToString,
             whereami__pb2.WhereamiReply.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)